@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import gzip
+import hashlib
+import json
+import os
+import time
+
+from TweetScraper.utils import mkdirs
+
+
+class ResponseArchive(object):
+
+    ''' compressed, content-addressed store of raw timeline pages
+
+        Every page (`items_html` and cursor) is stored once as `objects/<ab>/<sha1>.json.gz`,
+        no matter how often it was fetched. `index.jsonl` lists which page was fetched for
+        which query, window and cursor, in crawl order. `TweetScraper.replay` re-parses an
+        archive without network.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.objectPath = os.path.join(path, 'objects')
+        self.indexPath = os.path.join(path, 'index.jsonl')
+        mkdirs(self.objectPath)
+        self.index = None
+
+
+    def record(self, query, window, position, data):
+        ''' input:
+                query, window, position - the chain and cursor the page was fetched for
+                data - the decoded timeline response
+            output:
+                the digest the page is stored under
+        '''
+        page = {'items_html': data.get('items_html', ''), 'min_position': data.get('min_position'),
+                'has_more_items': data.get('has_more_items')}
+        blob = json.dumps(page, sort_keys=True).encode('utf-8')
+        digest = hashlib.sha1(blob).hexdigest()
+
+        fname = self.object_file(digest)
+        if not os.path.isfile(fname):
+            mkdirs(os.path.dirname(fname))
+            tmpName = '%s.%d.tmp' % (fname, os.getpid())
+            with gzip.open(tmpName, 'wb') as f:
+                f.write(blob)
+            os.rename(tmpName, fname)
+
+        if self.index is None:
+            self.index = open(self.indexPath, 'a')
+        self.index.write(json.dumps({'query': query, 'window': window, 'position': position,
+                                     'next_position': page['min_position'], 'digest': digest,
+                                     'fetched': time.time()}) + '\n')
+        self.index.flush()
+        return digest
+
+
+    def object_file(self, digest):
+        return os.path.join(self.objectPath, digest[:2], digest + '.json.gz')
+
+
+    def load(self, digest):
+        with gzip.open(self.object_file(digest), 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+
+
+    def entries(self, unique=True):
+        ''' iterate over the index, with `unique` every (query, page) pair only once '''
+        if not os.path.isfile(self.indexPath):
+            return
+        seen = set()
+        with open(self.indexPath) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                key = (entry['query'], entry['digest'])
+                if unique and key in seen:
+                    continue
+                seen.add(key)
+                yield entry
+
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+            self.index = None
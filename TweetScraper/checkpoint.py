@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import time
+
+from TweetScraper.utils import mkdirs
+
+
+class CheckpointStore(object):
+
+    ''' persists the `min_position` cursor of every pagination chain in SQLite
+
+        A chain is a query, optionally restricted to a (since, until) window. Each row holds
+        the cursor of the next page to fetch, so a crawl started with `-a resume=True` picks
+        up every unfinished chain where it stopped.
+    '''
+    def __init__(self, path):
+        mkdirs(os.path.dirname(path) or '.')
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS chains (
+                query TEXT NOT NULL,
+                since TEXT NOT NULL,
+                until TEXT NOT NULL,
+                position TEXT NOT NULL,
+                pages INTEGER NOT NULL DEFAULT 0,
+                done INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL,
+                PRIMARY KEY (query, since, until))''')
+        self.db.commit()
+
+
+    def save(self, query, window, position, pages=0, done=False):
+        since, until = window or ('', '')
+        self.db.execute('INSERT OR REPLACE INTO chains VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (query, since, until, position or '', pages, int(done), time.time()))
+        self.db.commit()
+
+
+    def finish(self, query, window):
+        since, until = window or ('', '')
+        self.db.execute('UPDATE chains SET done = 1, updated = ? WHERE query = ? AND since = ? AND until = ?',
+                        (time.time(), query, since, until))
+        self.db.commit()
+
+
+    def chains(self, query):
+        ''' output:
+                None if nothing is stored for `query`, otherwise a list of the unfinished
+                chains as (window, position, pages) tuples
+        '''
+        rows = self.db.execute('SELECT since, until, position, pages, done FROM chains WHERE query = ?',
+                               (query,)).fetchall()
+        if not rows:
+            return None
+        return [((since, until) if since or until else None, position, pages)
+                for since, until, position, pages, done in rows if not done]
+
+
+    def reset(self, query):
+        self.db.execute('DELETE FROM chains WHERE query = ?', (query,))
+        self.db.commit()
+
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import math
+import os
+import socket
+import sqlite3
+import time
+
+from TweetScraper.utils import mkdirs
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter(object):
+
+    ''' memory-bounded set of tweet IDs
+
+        Sized for `capacity` IDs with a false positive rate of `error_rate`; a false positive
+        means a new tweet is taken for a duplicate and skipped. 10M IDs at 0.1% take ~17MB.
+    '''
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.nbits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.nhashes = max(1, int(round(self.nbits / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.nbits + 7) // 8)
+        self.count = 0
+
+
+    def positions(self, key):
+        # double hashing: k positions out of one 128 bit digest
+        digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.nhashes):
+            yield (h1 + i * h2) % self.nbits
+
+
+    def __contains__(self, key):
+        for pos in self.positions(key):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+    def add(self, key):
+        for pos in self.positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+
+    def save(self, path):
+        ''' write the filter to `path` (atomically, through a temporary file) '''
+        header = {'capacity': self.capacity, 'error_rate': self.error_rate, 'count': self.count}
+        tmpPath = path + '.tmp'
+        with open(tmpPath, 'wb') as f:
+            f.write((json.dumps(header) + '\n').encode('utf-8'))
+            f.write(self.bits)
+        os.rename(tmpPath, path)
+
+
+    @classmethod
+    def load(cls, path, capacity, error_rate=0.001):
+        ''' load the filter saved at `path`, or create an empty one
+
+            A saved filter with a different capacity or error rate can not be reused and
+            is replaced by an empty one.
+        '''
+        bloom = cls(capacity, error_rate)
+        if not os.path.isfile(path):
+            return bloom
+
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline().decode('utf-8'))
+            bits = f.read()
+        if header['capacity'] != capacity or header['error_rate'] != error_rate or len(bits) != len(bloom.bits):
+            logger.warning("Ignoring dedup filter %s, it was built with other settings" %path)
+            return bloom
+
+        bloom.bits = bytearray(bits)
+        bloom.count = header['count']
+        if bloom.count > capacity:
+            logger.warning("Dedup filter %s holds %d IDs, more than its capacity of %d" %(path, bloom.count, capacity))
+        return bloom
+
+
+class LRUCache(object):
+
+    ''' bounded set of recently seen IDs
+
+        Holds at most `size` IDs and evicts the least recently seen first. With `ttl` (seconds)
+        an ID is reported as new again once it was first seen more than `ttl` ago.
+    '''
+    def __init__(self, size, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+
+    def seen(self, key):
+        ''' output: True if `key` was seen recently, otherwise remember it and return False '''
+        now = time.time()
+        added = self.entries.get(key)
+        if added is not None and (not self.ttl or now - added < self.ttl):
+            self.entries.move_to_end(key)
+            return True
+
+        self.entries[key] = now
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return False
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SharedDedupStore(object):
+
+    ''' tweet IDs claimed by any of the crawls on one host, in SQLite (WAL mode)
+
+        Parallel crawls (e.g. the containers of the bootstrap, with the database on a shared
+        volume) claim the IDs of every page before parsing it. Only the crawl which claimed an
+        ID first parses and writes that tweet, the others skip it.
+
+        Every claim records its owner, the query of the crawl (or `owner`, by default host and
+        pid). The same owner can claim its IDs again, so a retried or resumed crawl of a query
+        rewrites its own tweets instead of skipping them.
+    '''
+    def __init__(self, path, owner=None):
+        mkdirs(os.path.dirname(path) or '.')
+        self.owner = owner or '%s-%d' % (socket.gethostname(), os.getpid())
+        # wait for the write lock of the other crawls instead of failing
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS seen (
+                ID INTEGER PRIMARY KEY,
+                owner TEXT NOT NULL,
+                claimed REAL NOT NULL)''')
+        self.db.commit()
+
+
+    def claim(self, ids, owner=None):
+        ''' input:
+                ids - the tweet IDs of one page
+                owner - who claims them, e.g. the query (default: the owner of the store)
+            output:
+                the set of `ids` which no other owner had claimed before, now claimed by `owner`
+        '''
+        owner = owner or self.owner
+        claimed = set()
+        now = time.time()
+        with self.db: # one transaction per page
+            for ID in ids:
+                cursor = self.db.execute('INSERT OR IGNORE INTO seen VALUES (?, ?, ?)', (int(ID), owner, now))
+                if cursor.rowcount:
+                    claimed.add(ID)
+                    continue
+                # claimed before, by this owner (e.g. in a failed attempt) or by another one
+                cursor = self.db.execute('UPDATE seen SET claimed = ? WHERE ID = ? AND owner = ?', (now, int(ID), owner))
+                if cursor.rowcount:
+                    claimed.add(ID)
+        return claimed
+
+
+    def close(self):
+        self.db.close()
+
+
+class MediaIndex(object):
+
+    ''' which media URL is stored in which file, in SQLite (WAL mode)
+
+        The media pipeline stores every file under the hash of its content. The index maps the
+        URLs to these files, so a URL downloaded before (in this or an earlier or parallel crawl
+        with the same store) is not fetched again, and a file is written only once even when
+        several URLs serve the same content.
+    '''
+    def __init__(self, path):
+        mkdirs(os.path.dirname(path) or '.')
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS media (
+                url TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                checksum TEXT NOT NULL,
+                stored REAL NOT NULL)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS media_path ON media (path)')
+        self.db.commit()
+
+
+    def lookup(self, url):
+        ''' output: (path, checksum) of the file stored for `url`, or None '''
+        return self.db.execute('SELECT path, checksum FROM media WHERE url = ?', (url,)).fetchone()
+
+
+    def has_path(self, path):
+        ''' output: True if a file was already stored at `path` (for any URL) '''
+        return self.db.execute('SELECT 1 FROM media WHERE path = ? LIMIT 1', (path,)).fetchone() is not None
+
+
+    def add(self, url, path, checksum):
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?)', (url, path, checksum, time.time()))
+
+
+    def close(self):
+        self.db.close()
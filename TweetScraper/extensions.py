@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from TweetScraper.items import TWEET_TYPES
+from TweetScraper.utils import mkdirs
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram(object):
+
+    ''' cumulative histogram of durations (seconds), with Prometheus style `le` buckets '''
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+
+    def observe(self, value):
+        for i, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                break
+        else:
+            i = len(self.BUCKETS)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+    def quantile(self, q):
+        ''' upper bound of the bucket which holds the `q` quantile '''
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class StageMetrics(object):
+
+    ''' times the stages of a crawl per query and exports them periodically
+
+        Stages are `download` (download latency), `decode` (JSON decoding in `parse_page`),
+        `extract` (tweet extraction) and `pipeline` (`write_item` of the pipelines). Pages,
+        tweets and downloaded bytes are counted, and the queue depth of the threaded pipelines
+        is kept as a gauge. Every METRICS_INTERVAL seconds everything is written to METRICS_PATH,
+        as a Prometheus textfile (for the node_exporter textfile collector) or as JSON with rates.
+        With METRICS_PROFILE_RATE, that fraction of the pages is parsed under cProfile and the
+        profile is dumped to METRICS_PROFILE_PATH when the spider closes.
+
+        The spider and the pipelines reach the extension as `spider.stage_metrics`.
+    '''
+    FORMATS = ('prometheus', 'json')
+
+    def __init__(self, path, format='prometheus', interval=15, profile_rate=0, profile_path=None):
+        if format not in self.FORMATS:
+            raise NotConfigured("Unknown METRICS_FORMAT: %s" % format)
+        self.path = path
+        self.format = format
+        self.interval = interval
+        self.profileRate = profile_rate
+        self.profilePath = profile_path
+
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.profiler = cProfile.Profile() if profile_rate else None
+        self.profiledPages = 0
+        self.started = None
+        self.lastExport = None
+        self.exportLoop = None
+
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        ext = cls(settings['METRICS_PATH'], settings.get('METRICS_FORMAT', 'prometheus'),
+                  settings.getfloat('METRICS_INTERVAL', 15), settings.getfloat('METRICS_PROFILE_RATE'),
+                  settings.get('METRICS_PROFILE_PATH'))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        return ext
+
+
+    def spider_opened(self, spider):
+        spider.stage_metrics = self
+        self.started = time.time()
+        self.lastExport = (self.started, {})
+        mkdirs(os.path.dirname(self.path) or '.')
+        if self.interval > 0:
+            self.exportLoop = task.LoopingCall(self.export)
+            self.exportLoop.start(self.interval, now=False)
+
+
+    def spider_closed(self, spider):
+        if self.exportLoop is not None and self.exportLoop.running:
+            self.exportLoop.stop()
+        self.export()
+        if self.profiler is not None and self.profiledPages:
+            self.profiler.dump_stats(self.profilePath)
+            logger.info("Saved the profile of %d pages to %s" % (self.profiledPages, self.profilePath))
+        spider.stage_metrics = None
+
+
+    def response_received(self, response, request, spider):
+        query = request.meta.get('query')
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.observe('download', query, latency)
+        self.count('pages', query)
+        self.count('bytes', query, len(response.body))
+
+
+    def item_scraped(self, item, response, spider):
+        if isinstance(item, TWEET_TYPES):
+            self.count('tweets', item.get('query'))
+
+
+    def observe(self, stage, query, seconds):
+        ''' record that `stage` took `seconds` for a page or item of `query` (thread safe) '''
+        key = (stage, query or '')
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+
+    def count(self, name, query, n=1):
+        key = (name, query or '')
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+
+    def gauge(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+
+    def start_profile(self):
+        ''' output: True if this page is sampled, then `stop_profile` must be called after parsing it '''
+        if self.profiler is None or random.random() >= self.profileRate:
+            return False
+        self.profiler.enable()
+        return True
+
+
+    def stop_profile(self):
+        self.profiler.disable()
+        self.profiledPages += 1
+
+
+    def export(self):
+        ''' write the current metrics to METRICS_PATH (atomically, through a temporary file) '''
+        with self.lock:
+            if self.format == 'json':
+                content = json.dumps(self.json_metrics(), indent=2, sort_keys=True)
+            else:
+                content = self.prometheus_metrics()
+            self.lastExport = (time.time(), dict(self.counters))
+
+        tmpPath = self.path + '.tmp'
+        with open(tmpPath, 'w') as f:
+            f.write(content)
+        os.rename(tmpPath, self.path)
+
+
+    def prometheus_metrics(self):
+        lines = ['# TYPE tweetscraper_stage_seconds histogram']
+        for (stage, query), histogram in sorted(self.histograms.items()):
+            labels = 'stage="%s",query="%s"' % (stage, escape_label(query))
+            seen = 0
+            for bound, count in zip(Histogram.BUCKETS, histogram.counts):
+                seen += count
+                lines.append('tweetscraper_stage_seconds_bucket{%s,le="%s"} %d' % (labels, bound, seen))
+            lines.append('tweetscraper_stage_seconds_bucket{%s,le="+Inf"} %d' % (labels, histogram.count))
+            lines.append('tweetscraper_stage_seconds_sum{%s} %f' % (labels, histogram.sum))
+            lines.append('tweetscraper_stage_seconds_count{%s} %d' % (labels, histogram.count))
+
+        for name in sorted(set(name for name, _ in self.counters)):
+            lines.append('# TYPE tweetscraper_%s_total counter' % name)
+            for (counter, query), value in sorted(self.counters.items()):
+                if counter == name:
+                    lines.append('tweetscraper_%s_total{query="%s"} %d' % (name, escape_label(query), value))
+
+        for name in sorted(set(name for name, _ in self.gauges)):
+            lines.append('# TYPE tweetscraper_%s gauge' % name)
+            for (gauge, labels), value in sorted(self.gauges.items()):
+                if gauge == name:
+                    lines.append('tweetscraper_%s%s %s' % (name, format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+    def json_metrics(self):
+        now = time.time()
+        lastTime, lastCounters = self.lastExport
+        queries = {}
+        for (stage, query), histogram in self.histograms.items():
+            queries.setdefault(query, {}).setdefault('stages', {})[stage] = {
+                'count': histogram.count, 'seconds': histogram.sum,
+                'mean': histogram.sum / histogram.count if histogram.count else None,
+                'p50': histogram.quantile(0.5), 'p95': histogram.quantile(0.95), 'p99': histogram.quantile(0.99)}
+        for (name, query), value in self.counters.items():
+            entry = queries.setdefault(query, {})
+            entry[name] = value
+            # per second, since the last export and since the start
+            entry[name + '_per_second'] = (value - lastCounters.get((name, query), 0)) / max(now - lastTime, 1e-9)
+            entry[name + '_per_second_total'] = value / max(now - self.started, 1e-9)
+        gauges = dict((name + format_labels(labels), value) for (name, labels), value in self.gauges.items())
+        return {'time': now, 'elapsed': now - self.started, 'queries': queries, 'gauges': gauges,
+                'profiled_pages': self.profiledPages}
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, escape_label(str(value))) for key, value in labels)
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+
+def _has_class(name):
+    return "contains(concat(' ', normalize-space(@class), ' '), ' %s ')" % name
+
+
+class LxmlTweetExtractor(object):
+
+    ''' extracts the `Tweet`/`User` fields of `TweetScraper.parse_tweet_item` with plain lxml
+
+        All XPath expressions are compiled once. The attributes Twitter puts on the tweet
+        `div` itself (ID, permalink, user) are read directly instead of with `.//@...`
+        descendant scans, which only serve as fallback, and the three counters are read in
+        one pass over the action spans. Select it with `TWEET_EXTRACTOR = 'lxml'` or
+        `-a extractor=lxml`.
+    '''
+    parser = etree.HTMLParser(encoding='utf-8')
+
+    TWEETS = etree.XPath('//li[@data-item-type="tweet"]/div')
+    USERNAME = etree.XPath('.//span[@class="username u-dir u-textTruncate"]/b/text()')
+    TEXT = etree.XPath('.//div[@class="js-tweet-text-container"]/p//text()')
+    TIME = etree.XPath('.//div[@class="stream-item-header"]/small[@class="time"]/a/span/@data-time')
+    COUNTS = etree.XPath('.//span[%s]/span[%s]' % (_has_class('ProfileTweet-action--retweet') + ' or ' +
+                                                   _has_class('ProfileTweet-action--favorite') + ' or ' +
+                                                   _has_class('ProfileTweet-action--reply'),
+                                                   _has_class('ProfileTweet-actionCount')))
+    CARD_TYPE = etree.XPath('.//@data-card-type')
+    CARD2_TYPE = etree.XPath('.//@data-card2-type')
+    IMAGES = etree.XPath('.//*/div/@data-image-url')
+    VIDEOS = etree.XPath('.//*/source/@video-src')
+    CARD_URLS = etree.XPath('.//*/div/@data-card-url')
+    IS_REPLY = etree.XPath('boolean(.//div[@class="ReplyingToContextBelowAuthor"])')
+    IS_RETWEET = etree.XPath('boolean(.//span[@class="js-retweet-text"])')
+    AVATAR = etree.XPath('.//div[@class="content"]/div[@class="stream-item-header"]/a/img/@src')
+
+    COUNTERS = (('ProfileTweet-action--retweet', 'nbr_retweet'),
+                ('ProfileTweet-action--favorite', 'nbr_favorite'),
+                ('ProfileTweet-action--reply', 'nbr_reply'))
+    MEDIA_CARDS = ('player', 'summary_large_image', 'amplify', 'summary')
+
+    def tweet_nodes(self, html_page):
+        if not html_page or not html_page.strip():
+            return []
+        root = etree.fromstring(html_page.encode('utf-8'), self.parser)
+        if root is None:
+            return []
+        return self.TWEETS(root)
+
+    def attribute(self, node, name, required=False):
+        ''' first `name` attribute of `node` or its descendants, like `.//@name` '''
+        value = node.get(name)
+        if value is None:
+            values = node.xpath('.//@' + name)
+            if values:
+                value = str(values[0])
+            elif required:
+                raise ValueError('tweet without %s' % name)
+        return value
+
+    def tweet_id(self, node):
+        return self.attribute(node, 'data-tweet-id')
+
+    def tweet_fields(self, node, ID=None):
+        ''' output: a dict with the tweet fields (without `ID` and `query`, with the epoch `timestamp`
+            instead of `datetime`, see `TweetScraper.make_tweet`), or None for a tweet without text
+        '''
+        tweet = {}
+        tweet['usernameTweet'] = str(self.USERNAME(node)[0])
+
+        ### get text content
+        tweet['text'] = ' '.join(self.TEXT(node)).replace(' # ', '#').replace(' @ ', '@')
+        if tweet['text'] == '':
+            return None
+
+        ### get meta data
+        tweet['url'] = self.attribute(node, 'data-permalink-path', required=True)
+
+        for _, field in self.COUNTERS:
+            tweet[field] = 0
+        found = set()
+        for span in self.COUNTS(node):
+            classes = span.getparent().get('class', '').split()
+            count = span.get('data-tweet-stat-count')
+            if count is None:
+                continue
+            for cls, field in self.COUNTERS:
+                if cls in classes and field not in found:
+                    found.add(field)
+                    tweet[field] = int(count)
+
+        tweet['timestamp'] = int(self.TIME(node)[0])
+
+        ### get photo
+        has_cards = self.CARD_TYPE(node)
+        if has_cards and has_cards[0] == 'photo':
+            tweet['has_image'] = True
+            tweet['images'] = [str(url) for url in self.IMAGES(node)]
+        elif has_cards:
+            logger.debug('Not handle "data-card-type": %s (tweet %s)' % (has_cards[0], ID))
+
+        ### get animated_gif
+        has_cards = self.CARD2_TYPE(node)
+        if has_cards:
+            if has_cards[0] == 'animated_gif':
+                tweet['has_video'] = True
+                tweet['videos'] = [str(url) for url in self.VIDEOS(node)]
+            elif has_cards[0] in self.MEDIA_CARDS:
+                tweet['has_media'] = True
+                tweet['medias'] = [str(url) for url in self.CARD_URLS(node)]
+            elif has_cards[0] == '__entity_video':
+                pass  # TODO, see parse_tweet_item
+            else:  # there are many other types of card2 !!!!
+                logger.debug('Not handle "data-card2-type": %s (tweet %s)' % (has_cards[0], ID))
+
+        tweet['is_reply'] = self.IS_REPLY(node)
+        tweet['is_retweet'] = self.IS_RETWEET(node)
+
+        tweet['user_id'] = self.attribute(node, 'data-user-id', required=True)
+        return tweet
+
+    def user_fields(self, node, user_id):
+        return {
+            'ID': user_id,
+            'name': self.attribute(node, 'data-name', required=True),
+            'screen_name': self.attribute(node, 'data-screen-name', required=True),
+            'avatar': str(self.AVATAR(node)[0]),
+        }
@@ -2,6 +2,8 @@
 
 # Define here the models for your scraped items
 from scrapy import Item, Field
+from scrapy.item import BaseItem
+from datetime import datetime
 
 
 class Tweet(Item):
@@ -30,8 +32,120 @@ class Tweet(Item):
 
     query = Field()     # search string which was used to find
 
+    media_files = Field() # [{'url', 'path', 'checksum'}] of the downloaded media, see SaveMediaPipeline
+
 class User(Item):
     ID = Field()            # user id
     name = Field()          # user name
     screen_name = Field()   # user screen name
     avatar = Field()        # avator url
+
+
+class CompactTweet(BaseItem):
+
+    ''' memory and CPU friendly alternative to `Tweet`, used with `-a compact=True`
+
+        The fields are kept in `__slots__` instead of a dict: `ID` and `user_id` are ints,
+        `timestamp` is the UTC epoch of the post time, the five boolean fields are packed into
+        `flags`, and `images`, `videos`, `medias` and `media_files` are only set when present.
+        (`BaseItem` has no `__slots__`, so an instance still has a `__dict__`, it just stays empty.)
+        It can be read like a `Tweet` (`tweet['is_reply']`, `tweet.get('images')`, `dict(tweet)`),
+        `datetime` is derived from `timestamp` in UTC on request. `to_dict` serializes the ints
+        and the epoch directly for the pipelines, so the backends store numeric IDs and a
+        `timestamp` instead of the `datetime` string of a `Tweet`.
+    '''
+    __slots__ = ('ID', 'url', 'timestamp', 'text', 'user_id', 'usernameTweet', 'nbr_retweet',
+                 'nbr_favorite', 'nbr_reply', 'flags', 'images', 'videos', 'medias', 'query', 'media_files')
+    FLAGS = {'is_reply': 1, 'is_retweet': 2, 'has_image': 4, 'has_video': 8, 'has_media': 16}
+    FIELDS = ('ID', 'url', 'timestamp', 'text', 'user_id', 'usernameTweet', 'nbr_retweet',
+              'nbr_favorite', 'nbr_reply', 'query')
+    MEDIA = ('images', 'videos', 'medias', 'media_files')
+    # the field metadata for the item exporters, like `Tweet.fields`
+    fields = dict((name, Field()) for name in FIELDS + tuple(FLAGS) + MEDIA)
+
+    def __init__(self, fields):
+        ''' fields - the `Tweet` fields, with `timestamp` (epoch) instead of `datetime` '''
+        self.ID = int(fields['ID'])
+        self.url = fields.get('url')
+        self.timestamp = int(fields['timestamp'])
+        self.text = fields.get('text')
+        self.user_id = int(fields['user_id'])
+        self.usernameTweet = fields.get('usernameTweet')
+        self.nbr_retweet = fields.get('nbr_retweet', 0)
+        self.nbr_favorite = fields.get('nbr_favorite', 0)
+        self.nbr_reply = fields.get('nbr_reply', 0)
+        self.query = fields.get('query')
+        self.flags = 0
+        for name, bit in self.FLAGS.items():
+            if fields.get(name):
+                self.flags |= bit
+        for name in self.MEDIA:
+            setattr(self, name, fields.get(name) or None)
+
+
+    def __getitem__(self, key):
+        if key in self.FLAGS:
+            return bool(self.flags & self.FLAGS[key])
+        if key == 'datetime':
+            return datetime.utcfromtimestamp(self.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        if key in self.__slots__ and key != 'flags':
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        raise KeyError(key)
+
+
+    def __setitem__(self, key, value):
+        if key in self.FLAGS:
+            if value:
+                self.flags |= self.FLAGS[key]
+            else:
+                self.flags &= ~self.FLAGS[key]
+        elif key in self.__slots__ and key != 'flags':
+            setattr(self, key, value)
+        else:
+            raise KeyError("CompactTweet does not support field: %s" % key)
+
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+    def keys(self):
+        return list(self.to_dict())
+
+
+    def to_dict(self):
+        ''' the fields which are set as a plain dict, the flags as booleans '''
+        data = {}
+        for name in self.FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = value
+        flags = self.flags
+        for name, bit in self.FLAGS.items():
+            data[name] = bool(flags & bit)
+        for name in self.MEDIA:
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = value
+        return data
+
+
+    def __repr__(self):
+        return 'CompactTweet(%r)' % self.to_dict()
+
+
+# the item classes which hold a tweet
+TWEET_TYPES = (Tweet, CompactTweet)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+''' the media pipeline, in its own module so that only crawls which enable it load
+    `scrapy.pipelines.files`
+'''
+from scrapy.conf import settings
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from scrapy.pipelines.files import FilesPipeline
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import defer
+from io import BytesIO
+import hashlib
+import logging
+import mimetypes
+import os
+
+from TweetScraper.dedup import MediaIndex
+from TweetScraper.items import TWEET_TYPES
+
+logger = logging.getLogger(__name__)
+
+
+class SaveMediaPipeline(FilesPipeline):
+
+    ''' pipeline that downloads the images, videos and media of the tweets
+
+        The URLs of the MEDIA_FIELDS are fetched through the scrapy downloader (with its retries
+        and middlewares), at most MEDIA_CONCURRENT_PER_HOST at a time per host. Every file is
+        stored under the SHA1 of its content, as `<xx>/<sha1><ext>` under MEDIA_STORE, so media
+        shared between tweets (e.g. by retweets) are kept only once. The `MediaIndex` at
+        MEDIA_INDEX_PATH maps the URLs to their files, URLs found there are not downloaded again.
+
+        The mapping is set on the item as `media_files`, a list of `{'url', 'path', 'checksum'}`,
+        so enable this pipeline before the storage pipelines.
+    '''
+    def __init__(self, store_uri, download_func=None, settings=settings):
+        super(SaveMediaPipeline, self).__init__(store_uri, download_func=download_func, settings=settings)
+        self.fields = settings.getlist('MEDIA_FIELDS', ['images', 'videos', 'medias'])
+        self.perHost = max(1, settings.getint('MEDIA_CONCURRENT_PER_HOST', 4))
+        self.indexPath = settings['MEDIA_INDEX_PATH']
+        self.index = None
+        self.hostSlots = {}
+
+
+    @classmethod
+    def from_settings(cls, settings):
+        if not settings['MEDIA_STORE']:
+            raise NotConfigured("SaveMediaPipeline requires MEDIA_STORE")
+        return cls(settings['MEDIA_STORE'], settings=settings)
+
+
+    def open_spider(self, spider):
+        super(SaveMediaPipeline, self).open_spider(spider)
+        self.index = MediaIndex(self.indexPath)
+
+
+    def close_spider(self, spider):
+        self.index.close()
+
+
+    def get_media_requests(self, item, info):
+        if not isinstance(item, TWEET_TYPES):
+            return []
+        urls = []
+        for field in self.fields:
+            for url in item.get(field) or []:
+                if url not in urls:
+                    urls.append(url)
+        return [Request(url) for url in urls]
+
+
+    def media_to_download(self, request, info, **kwargs):
+        stored = self.index.lookup(request.url)
+        if stored is not None:
+            self.inc_stats(info.spider, 'indexed')
+            path, checksum = stored
+            return {'url': request.url, 'path': path, 'checksum': checksum}
+
+        # wait for a free slot of the host, released when the download succeeded or failed
+        d = self.host_slot(request).acquire()
+        d.addCallback(lambda _: None)
+        return d
+
+
+    def host_slot(self, request):
+        host = urlparse_cached(request).hostname
+        slot = self.hostSlots.get(host)
+        if slot is None:
+            slot = self.hostSlots[host] = defer.DeferredSemaphore(self.perHost)
+        return slot
+
+
+    def media_downloaded(self, response, request, info, **kwargs):
+        try:
+            return super(SaveMediaPipeline, self).media_downloaded(response, request, info, **kwargs)
+        finally:
+            self.host_slot(request).release()
+
+
+    def media_failed(self, failure, request, info):
+        self.host_slot(request).release()
+        return super(SaveMediaPipeline, self).media_failed(failure, request, info)
+
+
+    def file_path(self, request, response=None, info=None, **kwargs):
+        ''' the path of a downloaded file: the SHA1 of its content, with the extension of the URL
+            or else of the Content-Type
+        '''
+        if response is None:
+            return super(SaveMediaPipeline, self).file_path(request, response=response, info=info, **kwargs)
+
+        checksum = hashlib.sha1(response.body).hexdigest()
+        extension = os.path.splitext(urlparse_cached(request).path)[1].lower()
+        if extension not in mimetypes.types_map:
+            contentType = response.headers.get('Content-Type', b'').decode('latin-1').split(';')[0].strip()
+            extension = (mimetypes.guess_extension(contentType) if contentType else None) or ''
+        return '%s/%s%s' %(checksum[:2], checksum, extension)
+
+
+    def file_downloaded(self, response, request, info, **kwargs):
+        ''' store the file, unless a file with the same content is stored already '''
+        path = self.file_path(request, response=response, info=info)
+        checksum = os.path.splitext(os.path.basename(path))[0]
+        if self.index.has_path(path):
+            self.inc_stats(info.spider, 'duplicate_content')
+        else:
+            self.store.persist_file(path, BytesIO(response.body), info)
+        self.index.add(request.url, path, checksum)
+        return checksum
+
+
+    def item_completed(self, results, item, info):
+        if not isinstance(item, TWEET_TYPES) or not results:
+            return item
+
+        files = [dict(url=result['url'], path=result['path'], checksum=result['checksum'])
+                 for success, result in results if success]
+        if len(files) < len(results):
+            logger.debug("Failed to download %d of the %d media of tweet %s"
+                         %(len(results) - len(files), len(results), item['ID']))
+        if files:
+            item['media_files'] = files
+        return item
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+from scrapy.exceptions import NotConfigured
+from twisted.internet import reactor, task
+import json
+import logging
+import random
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveThrottleMiddleware(object):
+
+    ''' AIMD rate control of the search requests
+
+        A 429 or 503 response, or a throttled empty page, is a congestion signal: the
+        concurrency of the download slot is cut by ADAPTIVE_DECREASE and its delay doubled
+        (multiplicative decrease). The request is retried with the same `max_position` cursor
+        after a jittered exponential backoff, up to ADAPTIVE_MAX_RETRIES times. Every page with
+        tweets shrinks the delay by ADAPTIVE_DELAY_STEP and every `concurrency` such pages add one
+        concurrent request again, up to CONCURRENT_REQUESTS_PER_DOMAIN (additive increase). A page
+        slower than ADAPTIVE_TARGET_LATENCY holds the current rate.
+
+        An empty page is only taken for throttling while it still reports `has_more_items` or a
+        new cursor, the normal last page of a chain is passed on to the spider right away. A
+        throttled empty page is retried like a 429, and when the retries are used up it is passed
+        on without another decrease. The spider then stops the chain but keeps its checkpoint
+        open (see `TweetScraper.stop_reason`), so `-a resume=True` continues it.
+    '''
+    THROTTLE_CODES = (429, 503)
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.maxConcurrency = settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN')
+        self.minDelay = settings.getfloat('DOWNLOAD_DELAY')
+        self.maxDelay = settings.getfloat('ADAPTIVE_MAX_DELAY', 60)
+        self.delayStep = settings.getfloat('ADAPTIVE_DELAY_STEP', 0.1)
+        self.decrease = settings.getfloat('ADAPTIVE_DECREASE', 0.5)
+        self.targetLatency = settings.getfloat('ADAPTIVE_TARGET_LATENCY', 5)
+        self.maxRetries = settings.getint('ADAPTIVE_MAX_RETRIES', 5)
+        self.emptyMaxBytes = settings.getint('ADAPTIVE_EMPTY_MAX_BYTES', 4096)
+        self.backoff = settings.getfloat('ADAPTIVE_RETRY_BACKOFF', 2)
+        self.successes = {}
+
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ADAPTIVE_THROTTLE_ENABLED'):
+            raise NotConfigured
+        return cls(crawler)
+
+
+    def process_response(self, request, response, spider):
+        if 'position' not in request.meta:
+            return response # not a page of a search chain
+
+        slot = self.slot(request)
+        reason = self.throttle_reason(request, response)
+        if reason is None:
+            if response.status == 200 and slot is not None:
+                self.increase(slot, request)
+            return response
+
+        self.stats.inc_value('throttle/%s' % reason)
+        retries = request.meta.get('throttle_retries', 0)
+        exhausted = retries >= self.maxRetries
+        # nothing is retried after the last empty page, so there is nothing to back off for
+        if slot is not None and not (exhausted and reason == 'empty_page'):
+            self.decrease_rate(slot)
+
+        if exhausted:
+            logger.warning("Giving up on %s after %d retries (%s), resume the crawl to continue it"
+                           % (request.meta.get('query'), retries, reason))
+            self.stats.inc_value('throttle/gave_up')
+            return response
+
+        # same cursor again, after a jittered exponential backoff
+        retry = request.replace(dont_filter=True)
+        retry.meta['throttle_retries'] = retries + 1
+        delay = min(self.maxDelay, self.backoff * 2 ** retries) * random.uniform(0.5, 1.5)
+        logger.debug("Throttled (%s) on %s, retrying cursor %r in %.1fs"
+                     % (reason, request.meta.get('query'), request.meta.get('position'), delay))
+        self.stats.inc_value('throttle/retries')
+        return task.deferLater(reactor, delay, lambda: retry)
+
+
+    def throttle_reason(self, request, response):
+        if response.status in self.THROTTLE_CODES:
+            return 'http_%d' % response.status
+        if response.status != 200 or len(response.body) > self.emptyMaxBytes:
+            return None
+
+        # only small bodies can be empty pages, the large ones are not decoded here
+        try:
+            data = json.loads(response.body.decode('utf-8'))
+        except ValueError:
+            return None
+        if data.get('items_html', '').strip():
+            return None
+        # an empty page which ends the results says so, a throttled one still points further
+        cursor = data.get('min_position')
+        if data.get('has_more_items') or (cursor and cursor != request.meta.get('position')):
+            return 'empty_page'
+        return None
+
+
+    def slot(self, request):
+        key = request.meta.get('download_slot')
+        return self.crawler.engine.downloader.slots.get(key)
+
+
+    def decrease_rate(self, slot):
+        slot.concurrency = max(1, int(slot.concurrency * self.decrease))
+        slot.delay = min(self.maxDelay, max(slot.delay * 2, self.delayStep, self.minDelay))
+        self.successes[id(slot)] = 0
+        self.stats.max_value('throttle/max_delay', slot.delay)
+        self.stats.min_value('throttle/min_concurrency', slot.concurrency)
+
+
+    def increase(self, slot, request):
+        if request.meta.get('download_latency', 0) > self.targetLatency:
+            return
+
+        if slot.delay > self.minDelay:
+            slot.delay = max(self.minDelay, slot.delay - self.delayStep)
+        if slot.concurrency < self.maxConcurrency:
+            successes = self.successes.get(id(slot), 0) + 1
+            if successes >= slot.concurrency:
+                slot.concurrency += 1
+                successes = 0
+            self.successes[id(slot)] = successes
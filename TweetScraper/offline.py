@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+''' Run the spider's parse path and the item pipelines without network or reactor.
+
+    Used by the parser benchmark (`benchmarks/parse_benchmark.py`) and by `TweetScraper.replay`
+    to feed recorded timeline responses through the parse path and the pipelines.
+'''
+from scrapy.conf import settings
+from scrapy.crawler import Crawler
+from scrapy.http import TextResponse
+from scrapy.utils.misc import load_object
+
+from TweetScraper.spiders.TweetCrawler import TweetScraper
+
+
+def build_spider(overrides=None, **spider_kwargs):
+    ''' input:
+            overrides - a dict of settings which replace the project settings
+            spider_kwargs - the spider arguments, like `-a` on the command line
+        output:
+            the spider, bound to a crawler which provides settings and stats
+    '''
+    # the pipelines run synchronously here, nothing is checkpointed or archived, and the
+    # tweets are not skipped as seen by earlier crawls
+    defaults = {'PIPELINE_THREADED': False, 'STREAM_THREADED': False, 'CHECKPOINT_ENABLED': False,
+                'ARCHIVE_ENABLED': False, 'DEDUP_ENABLED': False, 'SHARED_DEDUP_ENABLED': False}
+    defaults.update(overrides or {})
+    for name, value in defaults.items():
+        settings.set(name, value, priority='cmdline')
+
+    crawler = Crawler(TweetScraper, settings)
+    spider = TweetScraper.from_crawler(crawler, **spider_kwargs)
+    crawler.spider = spider
+    return spider
+
+
+def open_pipelines(spider, paths=None):
+    ''' instantiate and open the pipelines `paths`, or the ones of ITEM_PIPELINES '''
+    if paths is None:
+        enabled = spider.crawler.settings.getdict('ITEM_PIPELINES')
+        paths = sorted(enabled, key=enabled.get)
+
+    pipelines = []
+    for path in paths:
+        cls = load_object(path)
+        if hasattr(cls, 'from_crawler'):
+            pipeline = cls.from_crawler(spider.crawler)
+        else:
+            pipeline = cls()
+        if hasattr(pipeline, 'open_spider'):
+            pipeline.open_spider(spider)
+        pipelines.append(pipeline)
+    return pipelines
+
+
+def process_item(pipelines, item, spider):
+    for pipeline in pipelines:
+        item = pipeline.process_item(item, spider)
+    return item
+
+
+def close_pipelines(pipelines, spider):
+    for pipeline in pipelines:
+        if hasattr(pipeline, 'close_spider'):
+            pipeline.close_spider(spider)
+
+
+def timeline_response(spider, body, query=None, window=None, position=''):
+    ''' wrap the raw body of a /i/search/timeline response like the downloader would '''
+    request = spider.page_request(query or spider.query, window, position)
+    return TextResponse(url=request.url, body=body, encoding='utf-8', request=request)
@@ -1,35 +1,237 @@
 # -*- coding: utf-8 -*-
-from scrapy.exceptions import DropItem
+from scrapy.exceptions import DropItem, NotConfigured
 from scrapy.conf import settings
+from twisted.internet import defer, task, threads
+from twisted.python.threadpool import ThreadPool
+import importlib
 import logging
-import pymongo
 import json
+import time
 import os
+import re
+import socket
+from datetime import datetime
+try:
+    from urllib import quote  # Python 2.X
+except ImportError:
+    from urllib.parse import quote  # Python 3+
 
-# for mysql
-import mysql.connector
-from mysql.connector import errorcode
-
-from TweetScraper.items import Tweet, User
+from TweetScraper.items import CompactTweet, User, TWEET_TYPES
+from TweetScraper.segments import SegmentWriter
 from TweetScraper.utils import mkdirs
 
 logger = logging.getLogger(__name__)
 
+# the client packages of the storage backends. They are imported by the pipelines which use them,
+# so a crawl only loads (and only requires) the backends of the pipelines in ITEM_PIPELINES
+BACKENDS = {
+    'mongodb': ('pymongo', 'pymongo.errors'),
+    'mysql': ('mysql.connector', 'mysql.connector.pooling'),
+    'parquet': ('pyarrow', 'pyarrow.compute', 'pyarrow.dataset', 'pyarrow.parquet'),
+}
 
-class SaveToMongoPipeline(object):
 
-    ''' pipeline that save data to mongodb '''
-    def __init__(self):
-        connection = pymongo.MongoClient(settings['MONGODB_SERVER'], settings['MONGODB_PORT'])
-        db = connection[settings['MONGODB_DB']]
-        self.tweetCollection = db[settings['MONGODB_TWEET_COLLECTION']]
-        self.userCollection = db[settings['MONGODB_USER_COLLECTION']]
-        self.tweetCollection.ensure_index([('ID', pymongo.ASCENDING)], unique=True, dropDups=True)
-        self.userCollection.ensure_index([('ID', pymongo.ASCENDING)], unique=True, dropDups=True)
+def import_backend(name, optional=False):
+    ''' input:
+            name - a key of BACKENDS
+            optional - the pipeline is an optional extra, which is left out without its package
+        output:
+            the client package of the backend, imported on first use
+        raises ImportError if the package is not installed, NotConfigured for an optional backend
+    '''
+    modules = BACKENDS[name]
+    try:
+        for module in modules:
+            importlib.import_module(module)
+    except ImportError as err:
+        message = "The %s backend requires `%s`: %s" % (name, modules[0], err)
+        if optional:
+            raise NotConfigured(message)
+        raise ImportError(message)
+    return importlib.import_module(modules[0])
+
+
+def to_dict(item):
+    ''' serialize an item for the backends, a `CompactTweet` without building a `Tweet` '''
+    if isinstance(item, CompactTweet):
+        return item.to_dict()
+    return dict(item)
+
+
+class ThreadedWriter(object):
+
+    ''' base class for pipelines whose blocking writes can run off the reactor thread
+
+        Subclasses implement `write_item(item, spider)`. With `PIPELINE_THREADED = True` every
+        write runs in one dedicated writer thread and `process_item` returns a Deferred. At most
+        `PIPELINE_MAX_IN_FLIGHT` writes are queued, further items wait for a free slot, so a slow
+        backend throttles the crawl instead of letting memory grow.
+
+        With `PIPELINE_OVERWRITE = True` items which are stored already are written again and
+        replace the stored ones (e.g. to backfill fields with `TweetScraper.replay`) instead of
+        being skipped.
+
+        Subclasses read their settings in `__init__` (the crawler settings, including `-s`
+        overrides, when built by `from_crawler`) and connect to their backend in `open_spider`.
+    '''
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings)
+
+
+    def init_writer(self, settings):
+        self.threaded = settings.getbool('PIPELINE_THREADED')
+        self.maxInFlight = settings.getint('PIPELINE_MAX_IN_FLIGHT', 100)
+        self.overwrite = settings.getbool('PIPELINE_OVERWRITE')
+        self.writerPool = None
+        self.inFlight = None
+
+
+    def start_writer(self, spider):
+        if not self.threaded:
+            return
+        # a single thread keeps the writes ordered and the connection/file handles unshared
+        self.writerPool = ThreadPool(minthreads=1, maxthreads=1, name='%s-writer' %type(self).__name__)
+        self.writerPool.start()
+        self.inFlight = defer.DeferredSemaphore(self.maxInFlight)
+
+
+    def stop_writer(self, final=None):
+        ''' wait for all queued writes, run `final` (e.g. a last flush) and stop the thread '''
+        if self.writerPool is None:
+            if final is not None:
+                final()
+            return None
+
+        def shutdown(_):
+            d = self.run_in_writer(final) if final is not None else defer.succeed(None)
+            d.addBoth(stop)
+            return d
+
+        def stop(result):
+            self.writerPool.stop()
+            self.writerPool = None
+            return result
+
+        # holding every token means no write is queued or running anymore
+        d = defer.gatherResults([self.inFlight.acquire() for _ in range(self.maxInFlight)])
+        d.addCallback(shutdown)
+        return d
+
+
+    def run_in_writer(self, func, *args):
+        ''' call `func` in the writer thread, or directly when not threaded '''
+        if self.writerPool is None:
+            return func(*args)
+        from twisted.internet import reactor
+        return threads.deferToThreadPool(reactor, self.writerPool, func, *args)
+
+
+    @property
+    def in_flight(self):
+        if self.inFlight is None:
+            return 0
+        return self.maxInFlight - self.inFlight.tokens + len(self.inFlight.waiting)
 
 
     def process_item(self, item, spider):
-        if isinstance(item, Tweet):
+        if self.writerPool is None:
+            return self.timed_write(item, spider)
+        if spider.stage_metrics is not None:
+            spider.stage_metrics.gauge('pipeline_in_flight', self.in_flight, pipeline=type(self).__name__)
+        return self.inFlight.run(self.run_in_writer, self.timed_write, item, spider)
+
+
+    def timed_write(self, item, spider):
+        if spider.stage_metrics is None:
+            return self.write_item(item, spider)
+        start = time.time()
+        try:
+            return self.write_item(item, spider)
+        finally:
+            spider.stage_metrics.observe('pipeline', item.get('query'), time.time() - start)
+
+
+    def write_item(self, item, spider):
+        raise NotImplementedError
+
+
+class SaveToMongoPipeline(ThreadedWriter):
+
+    ''' pipeline that save data to mongodb '''
+    COUNTERS = ('nbr_retweet', 'nbr_favorite', 'nbr_reply')
+
+    def __init__(self, settings=settings):
+        self.pymongo = import_backend('mongodb')
+        self.server = settings['MONGODB_SERVER']
+        self.port = settings['MONGODB_PORT']
+        self.dbName = settings['MONGODB_DB']
+        self.tweetCollectionName = settings['MONGODB_TWEET_COLLECTION']
+        self.userCollectionName = settings['MONGODB_USER_COLLECTION']
+        self.tweetCollection = None
+        self.userCollection = None
+
+        # buffered mode: collect items and let the unique `ID` index reject duplicates
+        self.buffered = settings.getbool('MONGODB_BUFFERED')
+        # update mode: refresh the counters of known tweets with batched upserts
+        self.update = settings.getbool('MONGODB_UPDATE')
+        if self.update:
+            self.buffered = True
+        self.batchSize = settings.getint('MONGODB_BATCH_SIZE', 1000)
+        self.flushInterval = settings.getfloat('MONGODB_FLUSH_INTERVAL', 5)
+        self.tweetBuffer = []
+        self.userBuffer = []
+        self.lastFlush = time.time()
+        self.flushLoop = None
+        self.stats = None
+        self.init_writer(settings)
+
+
+    def open_spider(self, spider):
+        self.stats = spider.crawler.stats
+        self.connect()
+        self.start_writer(spider)
+        if self.buffered and self.flushInterval > 0:
+            # flush on time even when no new items arrive to trigger it
+            self.flushLoop = task.LoopingCall(self.run_in_writer, self.flush_if_due)
+            self.flushLoop.start(self.flushInterval, now=False)
+
+
+    def close_spider(self, spider):
+        if self.flushLoop is not None and self.flushLoop.running:
+            self.flushLoop.stop()
+        return self.stop_writer(self.flush if self.buffered else None)
+
+
+    def connect(self):
+        connection = self.pymongo.MongoClient(self.server, self.port)
+        db = connection[self.dbName]
+        self.tweetCollection = db[self.tweetCollectionName]
+        self.userCollection = db[self.userCollectionName]
+        self.tweetCollection.ensure_index([('ID', self.pymongo.ASCENDING)], unique=True, dropDups=True)
+        self.userCollection.ensure_index([('ID', self.pymongo.ASCENDING)], unique=True, dropDups=True)
+
+
+    def watermark(self, query):
+        ''' output: the newest tweet ID stored for `query`, or None (see `-a incremental=True`) '''
+        self.tweetCollection.create_index([('query', self.pymongo.ASCENDING)])
+        # the IDs are stored as strings, compare them as numbers
+        result = list(self.tweetCollection.aggregate([
+            {'$match': {'query': query}},
+            {'$group': {'_id': None, 'ID': {'$max': {'$toLong': '$ID'}}}}]))
+        return result[0]['ID'] if result else None
+
+
+    def write_item(self, item, spider):
+        if self.buffered:
+            self.buffer_item(item)
+            return item
+
+        if self.overwrite and isinstance(item, TWEET_TYPES + (User,)):
+            collection = self.tweetCollection if isinstance(item, TWEET_TYPES) else self.userCollection
+            collection.replace_one({'ID': item['ID']}, to_dict(item), upsert=True)
+
+        elif isinstance(item, TWEET_TYPES):
             dbItem = self.tweetCollection.find_one({'ID': item['ID']})
             if dbItem:
                 pass # simply skip existing items
@@ -38,7 +240,7 @@ class SaveToMongoPipeline(object):
                 # self.tweetCollection.save(dbItem)
                 # logger.info("Update tweet:%s"%dbItem['url'])
             else:
-                self.tweetCollection.insert_one(dict(item))
+                self.tweetCollection.insert_one(to_dict(item))
                 logger.debug("Add tweet:%s" %item['url'])
 
         elif isinstance(item, User):
@@ -56,19 +258,156 @@ class SaveToMongoPipeline(object):
         else:
             logger.info("Item type is not recognized! type = %s" %type(item))
 
+        return item
+
+
+    def buffer_item(self, item):
+        if isinstance(item, TWEET_TYPES):
+            self.tweetBuffer.append(to_dict(item))
+        elif isinstance(item, User):
+            self.userBuffer.append(dict(item))
+        else:
+            logger.info("Item type is not recognized! type = %s" %type(item))
+            return
+
+        if len(self.tweetBuffer) + len(self.userBuffer) >= self.batchSize:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+
+    def flush_if_due(self):
+        if self.flushInterval > 0 and time.time() - self.lastFlush >= self.flushInterval:
+            self.flush()
+
+
+    def flush(self):
+        ''' write all buffered items with unordered bulk inserts '''
+        self.lastFlush = time.time()
+        tweets, self.tweetBuffer = self.tweetBuffer, []
+        users, self.userBuffer = self.userBuffer, []
+        if self.overwrite:
+            self.upsert_batch(self.tweetCollection, tweets, 'tweet', replace=True)
+            self.upsert_batch(self.userCollection, users, 'user', replace=True)
+            return
+
+        if self.update:
+            self.upsert_batch(self.tweetCollection, tweets, 'tweet')
+        else:
+            self.insert_batch(self.tweetCollection, tweets, 'tweet')
+        self.insert_batch(self.userCollection, users, 'user')
+
 
-class SavetoMySQLPipeline(object):
+    def insert_batch(self, collection, docs, kind):
+        ''' input:
+                collection - the mongodb collection to write to
+                docs - a list of dicts to insert
+                kind - 'tweet' or 'user', used for the stats keys
+        '''
+        if not docs:
+            return
+
+        inserted = len(docs)
+        duplicates = 0
+        try:
+            collection.insert_many(docs, ordered=False)
+        except self.pymongo.errors.BulkWriteError as err:
+            inserted = err.details.get('nInserted', 0)
+            for error in err.details.get('writeErrors', []):
+                if error.get('code') == 11000: # duplicate key on the unique `ID` index
+                    duplicates += 1
+                else:
+                    logger.error("Failed to insert %s:%s" %(kind, error.get('errmsg')))
+
+        logger.debug("Flushed %d %ss: %d inserted, %d duplicates" %(len(docs), kind, inserted, duplicates))
+        if self.stats is not None:
+            self.stats.inc_value('mongodb/%s_inserted' %kind, inserted)
+            self.stats.inc_value('mongodb/%s_duplicates' %kind, duplicates)
+            self.stats.inc_value('mongodb/batches')
 
-    ''' pipeline that save data to mysql '''
-    def __init__(self):
+
+    def upsert_batch(self, collection, docs, kind, replace=False):
+        ''' like `insert_batch`, but existing documents get the counters of `docs`
+
+            Only the counters and `last_seen` are sent for known IDs, the other fields
+            are written once, when the ID is inserted. With `replace`, existing documents
+            are replaced by `docs` as a whole.
+        '''
+        if not docs:
+            return
+
+        now = datetime.utcnow()
+        requests = []
+        for doc in docs:
+            if replace:
+                requests.append(self.pymongo.ReplaceOne({'ID': doc['ID']}, doc, upsert=True))
+                continue
+            counters = dict((field, doc.pop(field)) for field in self.COUNTERS if field in doc)
+            counters['last_seen'] = now
+            requests.append(self.pymongo.UpdateOne({'ID': doc['ID']}, {'$set': counters, '$setOnInsert': doc}, upsert=True))
+
+        try:
+            result = collection.bulk_write(requests, ordered=False).bulk_api_result
+        except self.pymongo.errors.BulkWriteError as err:
+            result = err.details
+            for error in err.details.get('writeErrors', []):
+                logger.error("Failed to upsert %s:%s" %(kind, error.get('errmsg')))
+
+        logger.debug("Flushed %d %ss: %d inserted, %d updated" %(len(docs), kind, result.get('nUpserted', 0),
+                                                                  result.get('nModified', 0)))
+        if self.stats is not None:
+            self.stats.inc_value('mongodb/%s_inserted' %kind, result.get('nUpserted', 0))
+            self.stats.inc_value('mongodb/%s_updated' %kind, result.get('nModified', 0))
+            self.stats.inc_value('mongodb/batches')
+
+
+class SavetoMySQLPipeline(ThreadedWriter):
+
+    ''' pipeline that save data to mysql
+
+        With `MYSQL_PRODUCTION = True` the connection is configured from the settings, tweets are
+        buffered and written with one parameterized `executemany` and one commit per batch, and
+        duplicates are handled by the primary key on `ID`. Otherwise the interactive mode asks
+        for the credentials at startup and writes row by row.
+    '''
+    COLUMNS = ('ID', 'url', 'datetime', 'text', 'user_id', 'usernameTweet',
+               'nbr_retweet', 'nbr_favorite', 'nbr_reply', 'is_reply', 'is_retweet', 'query')
+    COUNTERS = ('nbr_retweet', 'nbr_favorite', 'nbr_reply')
+    TRANSIENT_ERRNOS = (1205, 1213) # lock wait timeout, deadlock
+    CREATE_TABLE_QUERY = """CREATE TABLE IF NOT EXISTS `%s` (
+                `ID` BIGINT UNSIGNED NOT NULL,
+                `url` VARCHAR(255) NOT NULL,
+                `datetime` DATETIME,
+                `text` TEXT,
+                `user_id` BIGINT UNSIGNED NOT NULL,
+                `usernameTweet` VARCHAR(50) NOT NULL,
+                `nbr_retweet` INT UNSIGNED NOT NULL DEFAULT 0,
+                `nbr_favorite` INT UNSIGNED NOT NULL DEFAULT 0,
+                `nbr_reply` INT UNSIGNED NOT NULL DEFAULT 0,
+                `is_reply` BOOLEAN NOT NULL DEFAULT FALSE,
+                `is_retweet` BOOLEAN NOT NULL DEFAULT FALSE,
+                `query` VARCHAR(255),
+                PRIMARY KEY (`ID`)
+                ) DEFAULT CHARSET=utf8mb4"""
+
+    def __init__(self, settings=settings):
+        self.connector = import_backend('mysql')
+        self.production = settings.getbool('MYSQL_PRODUCTION')
+        self.stats = None
+        if self.production:
+            self.init_pool(settings)
+        self.init_writer(settings)
+
+
+    def init_interactive(self):
         # connect to mysql server
-        user = raw_input("MySQL User: ")
-        pwd = raw_input("Password: ")
-        self.cnx = mysql.connector.connect(user=user, password=pwd,
+        user = input("MySQL User: ")
+        pwd = input("Password: ")
+        self.cnx = self.connector.connect(user=user, password=pwd,
                                 host='localhost',
                                 database='tweets', buffered=True)
         self.cursor = self.cnx.cursor()
-        self.table_name = raw_input("Table name: ")
+        self.table_name = input("Table name: ")
         create_table_query =   "CREATE TABLE `" + self.table_name + "` (\
                 `ID` CHAR(20) NOT NULL,\
                 `url` VARCHAR(140) NOT NULL,\
@@ -81,23 +420,97 @@ class SavetoMySQLPipeline(object):
         try:
             print("Creating table...")
             self.cursor.execute(create_table_query)
-        except mysql.connector.Error as err:
+        except self.connector.Error as err:
             print(err.msg)
         else:
             self.cnx.commit()
             print("Successfully created table.")
 
+
+    def init_pool(self, settings):
+        ''' read the pool settings and prepare the insert query, the pool is created in `open_spider` '''
+        self.table_name = settings['MYSQL_TABLE']
+        if not re.match(r'^\w+$', self.table_name):
+            raise ValueError("Invalid MYSQL_TABLE: %r" %self.table_name)
+        self.batchSize = settings.getint('MYSQL_BATCH_SIZE', 500)
+        self.retries = settings.getint('MYSQL_RETRIES', 3)
+        self.retryDelay = settings.getfloat('MYSQL_RETRY_DELAY', 1)
+        self.pendingRetries = set()
+        self.buffer = []
+        self.pool = None
+        self.poolSettings = dict(pool_name='TweetScraper',
+                                 pool_size=settings.getint('MYSQL_POOL_SIZE', 4),
+                                 host=settings['MYSQL_HOST'],
+                                 port=settings.getint('MYSQL_PORT', 3306),
+                                 user=settings['MYSQL_USER'],
+                                 password=settings['MYSQL_PASSWORD'],
+                                 database=settings['MYSQL_DATABASE'],
+                                 charset='utf8mb4', autocommit=False)
+
+        columns = ', '.join('`%s`' %column for column in self.COLUMNS)
+        values = ', '.join(['%s'] * len(self.COLUMNS))
+        self.insert_query = "INSERT IGNORE INTO `%s` (%s) VALUES (%s)" %(self.table_name, columns, values)
+        if settings.getbool('PIPELINE_OVERWRITE') or settings.getbool('MYSQL_UPSERT'):
+            # replace the rows of tweets we have seen before, or refresh only their counters
+            if settings.getbool('PIPELINE_OVERWRITE'):
+                updated = [column for column in self.COLUMNS if column != 'ID']
+            else:
+                updated = self.COUNTERS
+            updates = ', '.join('`%s` = VALUES(`%s`)' %(column, column) for column in updated)
+            self.insert_query = "INSERT INTO `%s` (%s) VALUES (%s) ON DUPLICATE KEY UPDATE %s" \
+                                %(self.table_name, columns, values, updates)
+
+
+    def connect_pool(self):
+        self.pool = self.connector.pooling.MySQLConnectionPool(**self.poolSettings)
+        cnx = self.pool.get_connection()
+        try:
+            cursor = cnx.cursor()
+            cursor.execute(self.CREATE_TABLE_QUERY %self.table_name)
+            cnx.commit()
+            cursor.close()
+        finally:
+            cnx.close() # hands the connection back to the pool
+
+
+    def open_spider(self, spider):
+        self.stats = spider.crawler.stats
+        if self.production:
+            self.connect_pool()
+        else:
+            self.init_interactive()
+        self.start_writer(spider)
+
+
+    def close_spider(self, spider):
+        d = self.stop_writer(self.flush if self.production else None)
+        if self.pendingRetries:
+            # batches waiting for a retry on the reactor, see `write_batch`
+            return defer.DeferredList(list(self.pendingRetries))
+        return d
+
+    def watermark(self, query):
+        ''' output: the newest tweet ID stored for `query`, or None (see `-a incremental=True`) '''
+        if not self.production:
+            return None # the interactive table has no query column
+        cnx = self.pool.get_connection()
+        try:
+            cursor = cnx.cursor()
+            cursor.execute("SELECT MAX(`ID`) FROM `%s` WHERE `query` = %%s" %self.table_name, (query,))
+            row = cursor.fetchone()
+            cursor.close()
+        finally:
+            cnx.close()
+        return row[0] if row else None
+
     def find_one(self, trait, value):
-        select_query =  "SELECT " + trait + " FROM " + self.table_name + " WHERE " + trait + " = " + value + ";"
+        select_query = "SELECT " + trait + " FROM " + self.table_name + " WHERE " + trait + " = %s LIMIT 1;"
         try:
-            val = self.cursor.execute(select_query)
-        except mysql.connector.Error as err:
-            return False
-        
-        if (val == None):
+            self.cursor.execute(select_query, (value,))
+        except self.connector.Error as err:
             return False
-        else:
-            return True
+
+        return self.cursor.fetchone() is not None
 
     def check_vals(self, item):
         ID = item['ID']
@@ -129,30 +542,108 @@ class SavetoMySQLPipeline(object):
         if not ret:
             return None
 
-        ID = item['ID']
-        user_id = item['user_id']
-        url = item['url']
-        text = item['text']
-        username = item['usernameTweet']
-        datetime = item['datetime']
-
-        insert_query =  "INSERT INTO " + self.table_name + " (ID, url, datetime, text, user_id, usernameTweet )"
-        insert_query += " VALUES ( '" + ID + "', '" + url + "', '"
-        insert_query += datetime + "', '" + text + "', '" + user_id + "', '" + username + "' )"
+        insert_query = "INSERT INTO " + self.table_name + " (ID, url, datetime, text, user_id, usernameTweet )"
+        insert_query += " VALUES ( %s, %s, %s, %s, %s, %s )"
 
         try:
             print("Inserting...")
-            self.cursor.execute(insert_query)
-        except mysql.connector.Error as err:
+            self.cursor.execute(insert_query, (item['ID'], item['url'], item['datetime'],
+                                               item['text'], item['user_id'], item['usernameTweet']))
+        except self.connector.Error as err:
             print(err.msg)
         else:
             print("Successfully inserted.")
             self.cnx.commit()
 
 
-    def process_item(self, item, spider):
-        if isinstance(item, Tweet):
-            dbItem = self.find_one('user_id', item['ID'])
+    def tweet_row(self, item):
+        return (item['ID'], item['url'], item['datetime'], item['text'], item['user_id'], item['usernameTweet'],
+                item.get('nbr_retweet', 0), item.get('nbr_favorite', 0), item.get('nbr_reply', 0),
+                bool(item.get('is_reply')), bool(item.get('is_retweet')), item.get('query'))
+
+
+    def flush(self):
+        ''' write all buffered rows with one `executemany` and one commit '''
+        rows, self.buffer = self.buffer, []
+        if rows:
+            self.write_batch(rows)
+
+
+    def write_batch(self, rows, attempt=0):
+        ''' write `rows`, transient errors (lost connection, deadlock, lock wait timeout) are
+            retried up to MYSQL_RETRIES times with a growing delay before the batch is dropped
+
+            The delay is slept in the writer thread. On the reactor thread the retry is scheduled
+            with `deferLater` instead, so a failing batch does not stall the crawl.
+        '''
+        try:
+            written = self.write_rows(rows)
+        except self.connector.Error as err:
+            if attempt < self.retries and self.is_transient(err):
+                logger.warning("Failed to write %d tweets to mysql (%s), retrying" %(len(rows), err.msg))
+                if self.stats is not None:
+                    self.stats.inc_value('mysql/retries')
+                delay = self.retryDelay * 2 ** attempt
+                from twisted.internet import reactor
+                if self.writerPool is None and reactor.running:
+                    d = task.deferLater(reactor, delay, self.write_batch, rows, attempt + 1)
+                    self.pendingRetries.add(d)
+                    d.addBoth(self.retry_done, d)
+                    return d
+                time.sleep(delay)
+                return self.write_batch(rows, attempt + 1)
+            logger.error("Failed to write %d tweets to mysql:%s" %(len(rows), err.msg))
+            if self.stats is not None:
+                self.stats.inc_value('mysql/tweet_rows_dropped', len(rows))
+            return
+
+        logger.debug("Flushed %d tweets to mysql" %len(rows))
+        if self.stats is not None:
+            self.stats.inc_value('mysql/tweet_rows', len(rows))
+            self.stats.inc_value('mysql/tweet_rows_affected', written)
+            self.stats.inc_value('mysql/batches')
+
+
+    def retry_done(self, result, d):
+        self.pendingRetries.discard(d)
+        return result
+
+
+    def write_rows(self, rows):
+        ''' output: the affected rows, raises the connector error after a rollback '''
+        cnx = self.pool.get_connection()
+        try:
+            cursor = cnx.cursor()
+            try:
+                cursor.executemany(self.insert_query, rows)
+                cnx.commit()
+            except self.connector.Error:
+                try:
+                    cnx.rollback()
+                except self.connector.Error:
+                    pass # the connection is gone, nothing to roll back
+                raise
+            written = cursor.rowcount
+            cursor.close()
+        finally:
+            cnx.close() # hands the connection back to the pool
+        return written
+
+
+    def is_transient(self, err):
+        errors = self.connector.errors
+        return isinstance(err, (errors.OperationalError, errors.InterfaceError)) or err.errno in self.TRANSIENT_ERRNOS
+
+
+    def write_item(self, item, spider):
+        if isinstance(item, TWEET_TYPES) and self.production:
+            if self.check_vals(item):
+                self.buffer.append(self.tweet_row(item))
+            if len(self.buffer) >= self.batchSize:
+                self.flush()
+
+        elif isinstance(item, TWEET_TYPES):
+            dbItem = self.find_one('ID', item['ID'])
             if dbItem:
                 pass # simply skip existing items
                 ### or you can update the tweet, if you don't want to skip:
@@ -160,23 +651,99 @@ class SavetoMySQLPipeline(object):
                 # self.tweetCollection.save(dbItem)
                 # logger.info("Update tweet:%s"%dbItem['url'])
             else:
-                self.insert_one(dict(item))
+                self.insert_one(item)
                 logger.debug("Add tweet:%s" %item['url'])
 
+        return item
+
 
-class SaveToFilePipeline(object):
-    ''' pipeline that save data to disk '''
-    def __init__(self):
+class SaveToFilePipeline(ThreadedWriter):
+    ''' pipeline that save data to disk
+
+        `SAVE_FILE_MODE = 'file'` writes one JSON file per item, `'segment'` appends the items
+        to rolling (optionally compressed) JSONL segments, see `TweetScraper.segments`.
+    '''
+    def __init__(self, settings=settings):
         self.saveTweetPath = settings['SAVE_TWEET_PATH']
         self.saveUserPath = settings['SAVE_USER_PATH']
+
+        self.segmented = settings.get('SAVE_FILE_MODE', 'file') == 'segment'
+        self.segmentSettings = dict(max_bytes=settings.getint('SEGMENT_MAX_BYTES'),
+                                    max_seconds=settings.getint('SEGMENT_MAX_SECONDS'),
+                                    compression=settings.get('SEGMENT_COMPRESSION') or None)
+        self.tweetSegments = None
+        self.userSegments = None
+
+        # newest tweet ID per query, for `-a incremental=True`. Kept outside SAVE_TWEET_PATH,
+        # which holds only the tweets
+        self.watermarksPath = settings['SAVE_WATERMARKS_PATH']
+        self.watermarks = {}
+        self.watermarksChanged = False
+        self.init_writer(settings)
+
+
+    def open_spider(self, spider):
         mkdirs(self.saveTweetPath) # ensure the path exists
         mkdirs(self.saveUserPath)
+        if self.segmented:
+            self.tweetSegments = SegmentWriter(self.saveTweetPath, 'tweet', **self.segmentSettings)
+            self.userSegments = SegmentWriter(self.saveUserPath, 'user', **self.segmentSettings)
+        if os.path.isfile(self.watermarksPath):
+            with open(self.watermarksPath) as f:
+                self.watermarks = json.load(f)
+        self.start_writer(spider)
 
 
-    def process_item(self, item, spider):
-        if isinstance(item, Tweet):
-            savePath = os.path.join(self.saveTweetPath, item['ID'])
-            if os.path.isfile(savePath):
+    def close_spider(self, spider):
+        return self.stop_writer(self.finish)
+
+
+    def finish(self):
+        if self.segmented:
+            self.close_segments()
+        self.save_watermarks()
+
+
+    def close_segments(self):
+        self.tweetSegments.close()
+        self.userSegments.close()
+
+
+    def watermark(self, query):
+        ''' output: the newest tweet ID stored for `query`, or None (see `-a incremental=True`) '''
+        return self.watermarks.get(query)
+
+
+    def update_watermark(self, item):
+        query = item.get('query')
+        if query and int(item['ID']) > self.watermarks.get(query, 0):
+            self.watermarks[query] = int(item['ID'])
+            self.watermarksChanged = True
+
+
+    def save_watermarks(self):
+        ''' write the watermarks (atomically, through a temporary file) if a crawl moved them '''
+        if not self.watermarksChanged:
+            return
+        mkdirs(os.path.dirname(self.watermarksPath) or '.')
+        tmpPath = self.watermarksPath + '.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump(self.watermarks, f, indent=2, sort_keys=True)
+        os.rename(tmpPath, self.watermarksPath)
+        self.watermarksChanged = False
+
+
+    def write_item(self, item, spider):
+        if isinstance(item, TWEET_TYPES):
+            self.update_watermark(item)
+
+        if self.segmented:
+            self.write_segment(item)
+            return item
+
+        if isinstance(item, TWEET_TYPES):
+            savePath = os.path.join(self.saveTweetPath, str(item['ID']))
+            if os.path.isfile(savePath) and not self.overwrite:
                 pass # simply skip existing items
                 ### or you can rewrite the file, if you don't want to skip:
                 # self.save_to_file(item,savePath)
@@ -187,7 +754,7 @@ class SaveToFilePipeline(object):
 
         elif isinstance(item, User):
             savePath = os.path.join(self.saveUserPath, item['ID'])
-            if os.path.isfile(savePath):
+            if os.path.isfile(savePath) and not self.overwrite:
                 pass # simply skip existing items
                 ### or you can rewrite the file, if you don't want to skip:
                 # self.save_to_file(item,savePath)
@@ -199,6 +766,21 @@ class SaveToFilePipeline(object):
         else:
             logger.info("Item type is not recognized! type = %s" %type(item))
 
+        return item
+
+
+    def write_segment(self, item):
+        if isinstance(item, TWEET_TYPES):
+            if self.tweetSegments.write(str(item['ID']), to_dict(item), self.overwrite):
+                logger.debug("Add tweet:%s" %item['url'])
+
+        elif isinstance(item, User):
+            if self.userSegments.write(item['ID'], item, self.overwrite):
+                logger.debug("Add user:%s" %item['screen_name'])
+
+        else:
+            logger.info("Item type is not recognized! type = %s" %type(item))
+
 
     def save_to_file(self, item, fname):
         ''' input: 
@@ -206,4 +788,271 @@ class SaveToFilePipeline(object):
                 fname - where to save
         '''
         with open(fname,'w') as f:
-            json.dump(dict(item), f)
+            json.dump(to_dict(item), f)
+
+
+class SaveToParquetPipeline(ThreadedWriter):
+
+    ''' pipeline that save tweets to parquet files for analytics
+
+        Tweets are buffered in typed columns per query and day, and every PARQUET_ROW_GROUP_SIZE
+        tweets of a partition are written as one parquet file (a single row group) to
+        `<PARQUET_PATH>/query=<query>/date=<YYYY-MM-DD>/`, the hive layout which pandas,
+        pyarrow.dataset and spark read with partition pruning. `datetime` is stored as a UTC
+        timestamp and `date` is the UTC day, whichever timezone the crawl ran in. Users are not
+        written. Requires `pyarrow`.
+    '''
+    COLUMNS = (('ID', 'int64'), ('url', 'string'), ('datetime', 'timestamp'), ('text', 'string'),
+               ('user_id', 'int64'), ('usernameTweet', 'string'),
+               ('nbr_retweet', 'int64'), ('nbr_favorite', 'int64'), ('nbr_reply', 'int64'),
+               ('is_reply', 'bool'), ('is_retweet', 'bool'),
+               ('has_image', 'bool'), ('images', 'list'), ('has_video', 'bool'), ('videos', 'list'),
+               ('has_media', 'bool'), ('medias', 'list'))
+
+    def __init__(self, settings=settings):
+        self.pyarrow = import_backend('parquet', optional=True)
+        self.path = settings['PARQUET_PATH']
+        self.rowGroupSize = settings.getint('PARQUET_ROW_GROUP_SIZE', 100000)
+        self.maxBuffered = settings.getint('PARQUET_MAX_BUFFERED', 500000)
+        self.compression = settings.get('PARQUET_COMPRESSION', 'snappy')
+        self.schema = self.pyarrow.schema([(name, self.arrow_type(kind)) for name, kind in self.COLUMNS])
+        self.partitions = {}
+        self.buffered = 0
+        self.fileCount = 0
+        self.stats = None
+        self.init_writer(settings)
+
+
+    def arrow_type(self, kind):
+        if kind == 'timestamp':
+            return self.pyarrow.timestamp('s', tz='UTC')
+        if kind == 'list':
+            return self.pyarrow.list_(self.pyarrow.string())
+        if kind == 'bool':
+            return self.pyarrow.bool_()
+        return getattr(self.pyarrow, kind)()
+
+
+    def open_spider(self, spider):
+        self.stats = spider.crawler.stats
+        mkdirs(self.path)
+        self.start_writer(spider)
+
+
+    def close_spider(self, spider):
+        return self.stop_writer(self.flush)
+
+
+    def watermark(self, query):
+        ''' output: the newest tweet ID stored for `query`, or None (see `-a incremental=True`) '''
+        dirname = os.path.join(self.path, 'query=%s' %quote(query, safe=''))
+        if not os.path.isdir(dirname):
+            return None
+        # only the ID column of the partitions of this query is read
+        dataset = self.pyarrow.dataset.dataset(dirname, format='parquet', partitioning='hive')
+        return self.pyarrow.compute.max(dataset.to_table(columns=['ID'])['ID']).as_py()
+
+
+    def write_item(self, item, spider):
+        if not isinstance(item, TWEET_TYPES):
+            return item
+
+        posted = self.epoch(item)
+        key = (item.get('query') or '', time.strftime('%Y-%m-%d', time.gmtime(posted)))
+        columns = self.partitions.get(key)
+        if columns is None:
+            columns = self.partitions[key] = dict((name, []) for name, _ in self.COLUMNS)
+
+        for name, kind in self.COLUMNS:
+            if name == 'datetime':
+                value = posted
+            elif kind == 'int64':
+                value = int(item.get(name) or 0)
+            elif kind == 'bool':
+                value = bool(item.get(name))
+            elif kind == 'list':
+                value = list(item.get(name) or [])
+            else:
+                value = item.get(name)
+            columns[name].append(value)
+        self.buffered += 1
+
+        if len(columns['ID']) >= self.rowGroupSize:
+            self.write_partition(key)
+        elif self.buffered >= self.maxBuffered:
+            # too many small partitions in memory, write them all
+            self.flush()
+        return item
+
+
+    def epoch(self, item):
+        ''' output: the UTC epoch of the post time of `item` '''
+        if isinstance(item, CompactTweet):
+            return item['timestamp']
+        # `Tweet.datetime` is the local time of the crawl host, see `TweetScraper.make_tweet`
+        return int(time.mktime(time.strptime(item['datetime'], '%Y-%m-%d %H:%M:%S')))
+
+
+    def flush(self):
+        for key in list(self.partitions):
+            self.write_partition(key)
+
+
+    def write_partition(self, key):
+        ''' write the buffered tweets of partition `key` = (query, date) as one parquet file '''
+        columns = self.partitions.pop(key)
+        rows = len(columns['ID'])
+        self.buffered -= rows
+        if not rows:
+            return
+
+        query, date = key
+        dirname = os.path.join(self.path, 'query=%s' %quote(query, safe=''), 'date=%s' %date)
+        mkdirs(dirname)
+        self.fileCount += 1
+        fname = os.path.join(dirname, 'part-%d-%d-%d.parquet' %(int(time.time()), os.getpid(), self.fileCount))
+
+        table = self.pyarrow.Table.from_pydict(columns, schema=self.schema)
+        tmpName = fname + '.tmp'
+        self.pyarrow.parquet.write_table(table, tmpName, compression=self.compression, row_group_size=rows)
+        os.rename(tmpName, fname)
+
+        logger.debug("Wrote %d tweets to %s" %(rows, fname))
+        if self.stats is not None:
+            self.stats.inc_value('parquet/tweets', rows)
+            self.stats.inc_value('parquet/files')
+
+
+class SaveToStreamPipeline(ThreadedWriter):
+
+    ''' pipeline that streams the items as NDJSON to a local consumer
+
+        Every item is sent as one JSON line, with `_type` set to 'tweet' or 'user', over the
+        Unix domain socket at STREAM_PATH (`STREAM_MODE = 'unix'`, the consumer listens) or into
+        the named pipe STREAM_PATH (`'fifo'`, created if missing, the consumer reads). Lines are
+        sent in batches of STREAM_BATCH_SIZE, or after STREAM_FLUSH_INTERVAL seconds.
+
+        The writes run in the writer thread (also with `PIPELINE_THREADED = False`) and at most
+        STREAM_BUFFER_SIZE items are queued, so a slow consumer slows down the crawl. Without a
+        consumer a batch is retried STREAM_RECONNECT_ATTEMPTS times, once per second, and then
+        dropped. Without a reactor (`TweetScraper.offline`) `STREAM_THREADED = False` writes
+        synchronously instead, every STREAM_BATCH_SIZE items and on close.
+    '''
+    MODES = ('unix', 'fifo')
+
+    def __init__(self, settings=settings):
+        self.path = settings['STREAM_PATH']
+        self.mode = settings.get('STREAM_MODE', 'unix')
+        if self.mode not in self.MODES:
+            raise ValueError("Unknown STREAM_MODE: %r" %self.mode)
+        self.batchSize = settings.getint('STREAM_BATCH_SIZE', 100)
+        self.flushInterval = settings.getfloat('STREAM_FLUSH_INTERVAL', 0.05)
+        self.reconnectAttempts = settings.getint('STREAM_RECONNECT_ATTEMPTS', 60)
+        self.buffer = []
+        self.lastFlush = time.time()
+        self.flushLoop = None
+        self.stream = None
+        self.stats = None
+
+        self.init_writer(settings)
+        # a blocked consumer must never block the reactor thread
+        self.threaded = settings.getbool('STREAM_THREADED', True)
+        self.maxInFlight = settings.getint('STREAM_BUFFER_SIZE', 1000)
+
+
+    def open_spider(self, spider):
+        self.stats = spider.crawler.stats
+        if self.mode == 'fifo' and not os.path.exists(self.path):
+            mkdirs(os.path.dirname(self.path) or '.')
+            os.mkfifo(self.path)
+        self.start_writer(spider)
+        if self.flushInterval > 0 and self.threaded:
+            self.flushLoop = task.LoopingCall(self.run_in_writer, self.flush_if_due)
+            self.flushLoop.start(self.flushInterval, now=False)
+
+
+    def close_spider(self, spider):
+        if self.flushLoop is not None and self.flushLoop.running:
+            self.flushLoop.stop()
+        return self.stop_writer(self.close_stream)
+
+
+    def write_item(self, item, spider):
+        record = to_dict(item)
+        record['_type'] = 'tweet' if isinstance(item, TWEET_TYPES) else 'user'
+        self.buffer.append(json.dumps(record))
+        if len(self.buffer) >= self.batchSize:
+            self.flush()
+        return item
+
+
+    def flush_if_due(self):
+        if self.buffer and time.time() - self.lastFlush >= self.flushInterval:
+            self.flush()
+
+
+    def flush(self):
+        ''' send all buffered lines, blocks while the consumer does not read '''
+        self.lastFlush = time.time()
+        lines, self.buffer = self.buffer, []
+        if not lines:
+            return
+
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        for attempt in range(self.reconnectAttempts + 1):
+            try:
+                if self.stream is None:
+                    self.connect()
+                self.send(data)
+                break
+            except (IOError, OSError) as err:
+                self.disconnect()
+                if attempt < self.reconnectAttempts:
+                    if attempt == 0:
+                        logger.warning("Stream consumer at %s is not available (%s), retrying" %(self.path, err))
+                    time.sleep(1)
+        else:
+            logger.error("Dropped %d items, no stream consumer at %s" %(len(lines), self.path))
+            self.stats.inc_value('stream/dropped', len(lines))
+            return
+
+        self.stats.inc_value('stream/items', len(lines))
+        self.stats.inc_value('stream/batches')
+
+
+    def connect(self):
+        if self.mode == 'unix':
+            self.stream = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.stream.connect(self.path)
+        else:
+            # fails with ENXIO instead of blocking while no reader has the pipe open
+            fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+            os.set_blocking(fd, True)
+            self.stream = fd
+        logger.info("Streaming items to %s" %self.path)
+
+
+    def send(self, data):
+        if self.mode == 'unix':
+            self.stream.sendall(data)
+        else:
+            while data:
+                data = data[os.write(self.stream, data):]
+
+
+    def disconnect(self):
+        if self.stream is None:
+            return
+        try:
+            if self.mode == 'unix':
+                self.stream.close()
+            else:
+                os.close(self.stream)
+        except (IOError, OSError):
+            pass
+        self.stream = None
+
+
+    def close_stream(self):
+        self.flush()
+        self.disconnect()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+''' Re-parse an archive of recorded timeline pages, without network.
+
+    python -m TweetScraper.replay ./Data/archive --workers 4 --extractor lxml
+
+runs `parse_tweets_block` over every page recorded with `-a archive=True` (see
+`TweetScraper.archive`) and writes the items with the pipelines of ITEM_PIPELINES, or the
+ones given with `--pipeline`. Use it to backfill fields after the extraction changed, with
+`--overwrite` the stored tweets are replaced by the re-parsed ones. `-s NAME=VALUE` overrides
+a setting, like for `scrapy crawl`.
+'''
+import argparse
+import logging
+import multiprocessing
+import time
+
+from TweetScraper import offline
+from TweetScraper.archive import ResponseArchive
+from TweetScraper.items import TWEET_TYPES, User
+
+logger = logging.getLogger(__name__)
+
+
+def replay_entries(archivePath, entries, options):
+    ''' parse the archived pages `entries` in this process, output: (pages, tweets, users) '''
+    spider = offline.build_spider(options.get('settings'), extractor=options.get('extractor'),
+                                  crawl_user=options.get('crawl_user', False))
+    pipelines = offline.open_pipelines(spider, options.get('pipelines'))
+    archive = ResponseArchive(archivePath)
+
+    pages = tweets = users = 0
+    try:
+        for entry in entries:
+            data = archive.load(entry['digest'])
+            context = spider.page_context(entry['query'])
+            for item in spider.parse_tweets_block(data['items_html'], context):
+                if isinstance(item, TWEET_TYPES):
+                    tweets += 1
+                elif isinstance(item, User):
+                    users += 1
+                offline.process_item(pipelines, item, spider)
+            pages += 1
+    finally:
+        offline.close_pipelines(pipelines, spider)
+    return pages, tweets, users
+
+
+def _replay_worker(args):
+    return replay_entries(*args)
+
+
+def replay(archivePath, workers=1, **options):
+    ''' input:
+            archivePath - the ARCHIVE_PATH of the crawls to replay
+            workers - number of processes, each one parses a share of the pages
+            options - `extractor`, `crawl_user`, `pipelines` and `settings` (overrides)
+        output:
+            (pages, tweets, users) that were replayed
+    '''
+    entries = list(ResponseArchive(archivePath).entries())
+    if workers <= 1 or len(entries) < 2:
+        return replay_entries(archivePath, entries, options)
+
+    shares = [(archivePath, entries[n::workers], options) for n in range(workers)]
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.map(_replay_worker, shares)
+    finally:
+        pool.close()
+        pool.join()
+    return tuple(sum(counts) for counts in zip(*results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-parse an archive of recorded timeline pages.")
+    parser.add_argument('archive', help="The archive directory (ARCHIVE_PATH).")
+    parser.add_argument('-w', '--workers', type=int, default=1, help="Number of parser processes.")
+    parser.add_argument('--extractor', choices=('selector', 'lxml'), default=None)
+    parser.add_argument('--crawl-user', action='store_true')
+    parser.add_argument('--pipeline', action='append', dest='pipelines', default=None,
+                        help="Pipeline class to write the items with (default: ITEM_PIPELINES).")
+    parser.add_argument('--overwrite', action='store_true',
+                        help="Replace stored items instead of skipping them (PIPELINE_OVERWRITE).")
+    parser.add_argument('-s', '--set', action='append', dest='settings', default=[], metavar='NAME=VALUE',
+                        help="Override a setting, can be given multiple times.")
+    args = parser.parse_args()
+
+    overrides = {}
+    for setting in args.settings:
+        name, sep, value = setting.partition('=')
+        if not sep:
+            parser.error("Invalid -s value, use -s NAME=VALUE: %s" % setting)
+        overrides[name] = value
+    if args.overwrite:
+        overrides['PIPELINE_OVERWRITE'] = True
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s')
+    start = time.time()
+    pages, tweets, users = replay(args.archive, args.workers, extractor=args.extractor,
+                                  crawl_user=args.crawl_user, pipelines=args.pipelines, settings=overrides)
+    logger.info("Replayed %d pages: %d tweets, %d users in %.1fs" % (pages, tweets, users, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
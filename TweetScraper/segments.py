@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+import gzip
+import json
+import logging
+import os
+import time
+import zlib
+
+from TweetScraper.utils import mkdirs
+
+logger = logging.getLogger(__name__)
+
+
+def import_zstandard():
+    ''' output: the `zstandard` package, imported on first use (only for zstd segments), or None '''
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+class SegmentWriter(object):
+
+    ''' appends JSON lines to rolling segment files in one directory
+
+        The open segment is written as `<prefix>-<timestamp>-<pid>-<n>.jsonl[.gz|.zst].part` and
+        renamed to its final name once it holds `max_bytes` (uncompressed) or is older than
+        `max_seconds`, so readers only ever see complete segments. The IDs of all written
+        records are appended to the sidecar index `<prefix>.ids`, which is loaded on startup
+        and keeps the dedup check in memory.
+    '''
+    EXTENSIONS = {None: '.jsonl', 'gzip': '.jsonl.gz', 'zstd': '.jsonl.zst'}
+
+    def __init__(self, path, prefix, max_bytes=64 * 1024 * 1024, max_seconds=3600, compression=None):
+        if compression not in self.EXTENSIONS:
+            raise ValueError("Unknown segment compression: %r" %compression)
+        if compression == 'zstd' and import_zstandard() is None:
+            raise ValueError("Segment compression 'zstd' requires the `zstandard` package")
+
+        self.path = path
+        self.prefix = prefix
+        self.maxBytes = max_bytes
+        self.maxSeconds = max_seconds
+        self.compression = compression
+        self.extension = self.EXTENSIONS[compression]
+
+        self.segment = None
+        self.segmentPath = None
+        self.segmentBytes = 0
+        self.segmentOpened = 0
+        self.segmentCount = 0
+
+        mkdirs(self.path)
+        self.indexPath = os.path.join(self.path, prefix + '.ids')
+        self.recover()
+        self.ids = self.load_index()
+        self.index = open(self.indexPath, 'a')
+
+
+    def __contains__(self, ID):
+        return ID in self.ids
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def recover(self):
+        ''' finalize segments left open by a crawl that did not shut down cleanly
+
+            A segment which was cut off (a truncated compressed stream or a partial last line)
+            is rewritten with its complete lines only, or moved aside as `.corrupt` if none can
+            be read. The index is then rebuilt from the segments, so that the lost records are
+            written again.
+        '''
+        lost = False
+        liveWriters = False
+        for fname in sorted(os.listdir(self.path)):
+            if fname.startswith(self.prefix + '-') and fname.endswith('.part'):
+                if self.writer_alive(fname):
+                    liveWriters = True
+                    continue # another process on this host still writes to it
+                logger.info("Recovering segment:%s" %fname)
+                lost = self.recover_segment(os.path.join(self.path, fname)) or lost
+
+        if lost:
+            if liveWriters:
+                logger.warning("Not rebuilding %s while other writers are alive, the lost records are skipped as duplicates"
+                               %self.indexPath)
+            else:
+                self.rebuild_index()
+
+
+    def recover_segment(self, partPath):
+        ''' output: True if records of the segment were lost '''
+        finalPath = partPath[:-len('.part')]
+        data, complete = self.read_segment(partPath)
+        if complete:
+            os.rename(partPath, finalPath)
+            return False
+
+        if not data:
+            logger.warning("Segment %s is unreadable, moved to %s.corrupt" %(partPath, finalPath))
+            os.rename(partPath, finalPath + '.corrupt')
+            return True
+
+        logger.warning("Segment %s was cut off, keeping its %d complete records" %(partPath, data.count(b'\n')))
+        tmpPath = finalPath + '.tmp'
+        segment = self.open_file(tmpPath, self.compression_of(partPath))
+        segment.write(data)
+        segment.close()
+        os.rename(tmpPath, finalPath)
+        os.remove(partPath)
+        return True
+
+
+    def read_segment(self, path):
+        ''' output: the complete lines of the segment `path`, and True if it ended cleanly '''
+        with open(path, 'rb') as f:
+            raw = f.read()
+        compression = self.compression_of(path)
+        zstandard = import_zstandard() if compression == 'zstd' else None
+        if not raw or compression is None or (compression == 'zstd' and zstandard is None):
+            data, complete = raw, True
+        else:
+            if compression == 'gzip':
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                decompressor = zstandard.ZstdDecompressor().decompressobj()
+            try:
+                data = decompressor.decompress(raw)
+                complete = decompressor.eof
+            except Exception: # zlib.error or zstandard.ZstdError, the stream is damaged
+                data, complete = b'', False
+
+        end = data.rfind(b'\n') + 1
+        return data[:end], complete and end == len(data)
+
+
+    def rebuild_index(self):
+        ''' write the index again from the `ID`s of the records in the segments '''
+        ids = set()
+        for fname in sorted(os.listdir(self.path)):
+            if fname.startswith(self.prefix + '-') and fname.endswith(tuple(self.EXTENSIONS.values())):
+                data, _ = self.read_segment(os.path.join(self.path, fname))
+                for line in data.splitlines():
+                    ids.add(str(json.loads(line.decode('utf-8'))['ID']))
+
+        tmpPath = self.indexPath + '.tmp'
+        with open(tmpPath, 'w') as f:
+            f.writelines('%s\n' %ID for ID in ids)
+        os.rename(tmpPath, self.indexPath)
+        logger.info("Rebuilt %s with %d IDs" %(self.indexPath, len(ids)))
+
+
+    def compression_of(self, fname):
+        ''' output: the compression of the segment file `fname` (finished or `.part`) by its extension '''
+        if fname.endswith('.part'):
+            fname = fname[:-len('.part')]
+        for compression, extension in self.EXTENSIONS.items():
+            if compression is not None and fname.endswith(extension):
+                return compression
+        return None
+
+
+    def writer_alive(self, fname):
+        try:
+            pid = int(fname[len(self.prefix) + 1:].split('-')[1])
+        except (IndexError, ValueError):
+            return False
+        if pid == os.getpid():
+            return False
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        return True
+
+
+    def load_index(self):
+        ids = set()
+        if os.path.isfile(self.indexPath):
+            with open(self.indexPath) as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        ids.add(line)
+        return ids
+
+
+    def open_segment(self):
+        self.segmentCount += 1
+        fname = '%s-%d-%d-%d%s.part' %(self.prefix, int(time.time()), os.getpid(), self.segmentCount, self.extension)
+        self.segmentPath = os.path.join(self.path, fname)
+        self.segment = self.open_file(self.segmentPath, self.compression)
+        self.segmentBytes = 0
+        self.segmentOpened = time.time()
+
+
+    @staticmethod
+    def open_file(path, compression):
+        if compression == 'gzip':
+            return gzip.open(path, 'wb')
+        if compression == 'zstd':
+            return import_zstandard().ZstdCompressor().stream_writer(open(path, 'wb'))
+        return open(path, 'wb')
+
+
+    def write(self, ID, record, overwrite=False):
+        ''' input:
+                ID - the unique id of the record
+                record - a dict like object
+                overwrite - append the record even if the ID was written before, readers
+                            then keep the last record of an ID
+            output:
+                False if the ID was written before (and not overwritten), True otherwise
+        '''
+        known = ID in self.ids
+        if known and not overwrite:
+            return False
+
+        if self.segment is None:
+            self.open_segment()
+        line = (json.dumps(dict(record)) + '\n').encode('utf-8')
+        self.segment.write(line)
+        self.segmentBytes += len(line)
+        if not known:
+            self.ids.add(ID)
+            self.index.write('%s\n' %ID)
+
+        if self.segmentBytes >= self.maxBytes or \
+                (self.maxSeconds and time.time() - self.segmentOpened >= self.maxSeconds):
+            self.roll()
+        return True
+
+
+    def roll(self):
+        ''' close the open segment and atomically move it to its final name '''
+        if self.segment is None:
+            return
+        self.segment.close()
+        self.index.flush()
+        os.rename(self.segmentPath, self.segmentPath[:-len('.part')])
+        logger.debug("Finished segment:%s" %self.segmentPath[:-len('.part')])
+        self.segment = None
+        self.segmentPath = None
+
+
+    def close(self):
+        self.roll()
+        self.index.close()
@@ -11,14 +11,125 @@ DOWNLOAD_HANDLERS = {'s3': None} # from http://stackoverflow.com/a/31233576/2297
 SPIDER_MODULES = ['TweetScraper.spiders']
 NEWSPIDER_MODULE = 'TweetScraper.spiders'
 ITEM_PIPELINES = {
+    #'TweetScraper.media.SaveMediaPipeline':50, # add this to download the media (before the storage pipelines)
     #'TweetScraper.pipelines.SaveToFilePipeline':100,
     'TweetScraper.pipelines.SaveToMongoPipeline':100, # replace `SaveToFilePipeline` with this to use MongoDB
     #'TweetScraper.pipelines.SavetoMySQLPipeline':100, # replace `SaveToFilePipeline` with this to use MySQL
+    #'TweetScraper.pipelines.SaveToParquetPipeline':200, # add this to also write parquet files for analytics
+    #'TweetScraper.pipelines.SaveToStreamPipeline':300, # add this to stream the items to a local consumer
 }
 
+# concurrency and rate: the AdaptiveThrottleMiddleware lowers both when twitter throttles
+# (429/503 or empty pages) and raises them again as long as pages come back fine
+CONCURRENT_REQUESTS_PER_DOMAIN = 8  # upper bound of the adaptive concurrency
+DOWNLOAD_DELAY = 0                  # lower bound of the adaptive delay (randomized 0.5x-1.5x)
+DOWNLOADER_MIDDLEWARES = {
+    'TweetScraper.middlewares.AdaptiveThrottleMiddleware': 560, # sees responses before RetryMiddleware
+}
+ADAPTIVE_THROTTLE_ENABLED = True
+ADAPTIVE_DECREASE = 0.5             # concurrency factor on a throttled response
+ADAPTIVE_DELAY_STEP = 0.1           # seconds the delay shrinks per good page
+ADAPTIVE_MAX_DELAY = 60             # cap of the delay and of the retry backoff
+ADAPTIVE_TARGET_LATENCY = 5         # do not speed up while pages take longer than this
+ADAPTIVE_MAX_RETRIES = 5            # retries of one cursor on 429/503 or a throttled empty page
+ADAPTIVE_EMPTY_MAX_BYTES = 4096     # larger pages are never taken for empty ones (and not decoded)
+ADAPTIVE_RETRY_BACKOFF = 2          # first retry after ~N seconds, doubled for every further one
+
+# per stage timings (download, decode, extract, pipeline) and counters per query, exported
+# every METRICS_INTERVAL seconds to METRICS_PATH
+EXTENSIONS = {
+    'TweetScraper.extensions.StageMetrics': 500,
+}
+METRICS_ENABLED = False
+METRICS_FORMAT = 'prometheus'       # 'prometheus' (textfile collector format) or 'json'
+METRICS_PATH = './Data/metrics.prom'
+METRICS_INTERVAL = 15               # seconds between exports (0: only when the spider closes)
+METRICS_PROFILE_RATE = 0            # fraction of the pages parsed under cProfile, e.g. 0.01
+METRICS_PROFILE_PATH = './Data/parse.pstats'
+
+# skip tweets that were already crawled (in this or earlier runs) before they are parsed,
+# the seen IDs are kept in a Bloom filter which is saved to DEDUP_PATH when the spider closes
+DEDUP_ENABLED = False               # or per crawl: -a dedup=True
+DEDUP_PATH = './Data/seen_tweets.bloom'
+DEDUP_CAPACITY = 10000000           # number of IDs the filter is sized for
+DEDUP_ERROR_RATE = 0.001            # chance that a new tweet is taken for a duplicate
+
+# how tweets are extracted from the result pages: 'selector' (scrapy selectors) or 'lxml'
+# (precompiled lxml XPath, same fields), or per crawl: -a extractor=lxml
+TWEET_EXTRACTOR = 'selector'
+
+# separator of the queries in `-a queries="foo;#bar"`, every query is crawled as its own chain
+QUERY_SEPARATOR = ';'
+
+# skip tweets which a parallel crawl on this host has already claimed (see `--shared-dedup`
+# of the bootstrap), the claimed IDs are shared through a SQLite database in WAL mode
+SHARED_DEDUP_ENABLED = False        # or per crawl: -a shared_dedup=True
+SHARED_DEDUP_PATH = './Data/shared_dedup.db'
+
+# time-window sharding (with -a since=YYYY-MM-DD): the query is split into since:/until: windows
+# of SHARD_WINDOW_DAYS days which are crawled concurrently, windows which still need more than
+# SHARD_SPLIT_PAGES pages are split again
+SHARD_WINDOW_DAYS = 0               # 0 disables sharding, or per crawl: -a window_days=30
+SHARD_SPLIT_PAGES = 50
+
+# checkpoints: the cursor of every pagination chain is saved here after each page,
+# restart a crawl with `-a resume=True` to continue where it stopped (a crawl started
+# with `-a resume=True` always checkpoints, even with CHECKPOINT_ENABLED = False)
+CHECKPOINT_ENABLED = False          # off by default: the docker image's workdir can be mounted read-only
+CHECKPOINT_PATH = './Data/checkpoints.db'
+
+# end of results: a chain also stops on an empty page, a repeated cursor or `has_more_items == false`
+MAX_EMPTY_PAGES = 3                 # stop a chain after N consecutive pages without new tweets (0 disables)
+MAX_PAGES = 0                       # max pages per chain, or per crawl: -a max_pages=100 (0 = unlimited)
+MAX_TWEETS = 0                      # close the spider after N tweets, or -a max_tweets=10000 (0 = unlimited)
+
+# archive of the raw result pages, re-parse it with `python -m TweetScraper.replay ARCHIVE_PATH`
+ARCHIVE_ENABLED = False             # or per crawl: -a archive=True
+ARCHIVE_PATH = './Data/archive'
+
+# with crawl_user, every user is extracted and emitted only once per USER_CACHE_SIZE recent users
+USER_CACHE_SIZE = 100000            # 0 emits the user with every tweet
+USER_CACHE_TTL = 0                  # emit a user again after N seconds to refresh it (0 = never)
+
+# yield tweets as compact records (int IDs, UTC epoch `timestamp`, packed flags) instead of
+# Tweet items, see TweetScraper.items.CompactTweet. They are stored with int IDs and `timestamp`,
+# so give compact crawls their own MONGODB_TWEET_COLLECTION / MYSQL_TABLE / SAVE_TWEET_PATH
+COMPACT_ITEMS = False               # or per crawl: -a compact=True
+
+# run the blocking writes of the pipelines in a writer thread instead of the reactor thread
+PIPELINE_THREADED = False
+PIPELINE_MAX_IN_FLIGHT = 100        # max queued writes before the crawl is throttled
+PIPELINE_OVERWRITE = False          # True: replace items which are stored already instead of skipping them
+
 # settings for where to save data on disk
 SAVE_TWEET_PATH = './Data/tweet/'
 SAVE_USER_PATH = './Data/user/'
+SAVE_WATERMARKS_PATH = './Data/watermarks.json'  # newest tweet ID per query, for -a incremental=True
+SAVE_FILE_MODE = 'file'             # 'file': one JSON file per item, 'segment': rolling JSONL segments
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024  # roll a segment after this many (uncompressed) bytes
+SEGMENT_MAX_SECONDS = 3600          # ... or after this many seconds
+SEGMENT_COMPRESSION = None          # None, 'gzip' or 'zstd' (requires `zstandard`)
+
+# settings for parquet (TweetScraper.pipelines.SaveToParquetPipeline, requires `pyarrow`)
+PARQUET_PATH = './Data/parquet/'    # partitioned as query=<query>/date=<YYYY-MM-DD>/
+PARQUET_ROW_GROUP_SIZE = 100000     # tweets per file (one row group) of a partition
+PARQUET_MAX_BUFFERED = 500000       # write all partitions when this many tweets are buffered
+PARQUET_COMPRESSION = 'snappy'      # 'snappy', 'zstd', 'gzip' or 'none'
+
+# settings for streaming NDJSON to a local consumer (TweetScraper.pipelines.SaveToStreamPipeline)
+STREAM_MODE = 'unix'                # 'unix': connect to a listening Unix socket, 'fifo': write into a named pipe
+STREAM_PATH = './Data/tweets.sock'
+STREAM_BATCH_SIZE = 100             # lines per write
+STREAM_FLUSH_INTERVAL = 0.05        # send a partial batch after N seconds
+STREAM_BUFFER_SIZE = 1000           # max queued items before the crawl waits for the consumer
+STREAM_RECONNECT_ATTEMPTS = 60      # retries (one per second) of a batch without consumer before it is dropped
+STREAM_THREADED = True              # False only without a reactor, see TweetScraper.offline
+
+# settings for downloading media (TweetScraper.media.SaveMediaPipeline)
+MEDIA_STORE = './Data/media/'       # files are stored as <xx>/<sha1 of the content><ext>
+MEDIA_INDEX_PATH = './Data/media/index.db'  # URL -> file, URLs in here are not downloaded again
+MEDIA_FIELDS = ['images', 'videos', 'medias']  # item fields with the URLs to download
+MEDIA_CONCURRENT_PER_HOST = 4       # concurrent media downloads per host
 
 # settings for mongodb
 MONGODB_SERVER = "127.0.0.1"
@@ -27,4 +138,23 @@ MONGODB_DB = "TweetScraper"         # database name to save the crawled data
 MONGODB_TWEET_COLLECTION = "tweet"  # collection name to save tweets
 MONGODB_USER_COLLECTION = "user"    # collection name to save users
 
+# buffered mongodb writes: items are collected and flushed with unordered bulk inserts,
+# duplicates are rejected by the unique `ID` index instead of a lookup per item
+MONGODB_BUFFERED = False            # set to True to enable buffered writes
+MONGODB_BATCH_SIZE = 1000           # flush when this many items are buffered
+MONGODB_FLUSH_INTERVAL = 5          # flush at least every N seconds (0 disables the timer)
+MONGODB_UPDATE = False              # refresh the counters of known tweets with bulk upserts (implies buffered)
 
+# settings for mysql (production mode, without the interactive prompts)
+MYSQL_PRODUCTION = False            # set to True to configure the connection from these settings
+MYSQL_HOST = "127.0.0.1"
+MYSQL_PORT = 3306
+MYSQL_USER = "tweetscraper"
+MYSQL_PASSWORD = ""
+MYSQL_DATABASE = "tweets"
+MYSQL_TABLE = "tweet"               # created with a primary key on `ID` if it does not exist
+MYSQL_BATCH_SIZE = 500              # rows per `executemany` and commit
+MYSQL_POOL_SIZE = 4                 # connections in the pool
+MYSQL_UPSERT = False                # True: refresh the counters of existing tweets, False: ignore duplicates
+MYSQL_RETRIES = 3                   # retries of a batch after a transient error (lost connection, deadlock)
+MYSQL_RETRY_DELAY = 1               # seconds before the first retry, doubled with every attempt
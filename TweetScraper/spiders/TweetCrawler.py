@@ -2,8 +2,10 @@ from scrapy.spiders import CrawlSpider, Rule
 from scrapy.selector import Selector
 from scrapy.conf import settings
 from scrapy import http
+from scrapy.exceptions import CloseSpider
 from scrapy.shell import inspect_response  # for debugging
 import re
+import os
 import json
 import time
 import logging
@@ -12,9 +14,14 @@ try:
 except ImportError:
     from urllib.parse import quote  # Python 3+
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from TweetScraper.items import Tweet, User
+from TweetScraper.items import Tweet, CompactTweet, User
+from TweetScraper.archive import ResponseArchive
+from TweetScraper.checkpoint import CheckpointStore
+from TweetScraper.dedup import BloomFilter, LRUCache, SharedDedupStore
+from TweetScraper.extractors import LxmlTweetExtractor
+from TweetScraper.utils import mkdirs, to_bool
 
 logger = logging.getLogger(__name__)
 
@@ -23,9 +30,17 @@ class TweetScraper(CrawlSpider):
     name = 'TweetScraper'
     allowed_domains = ['twitter.com']
 
-    def __init__(self, query='', lang='', crawl_user=False, top_tweet=False):
+    # set by the StageMetrics extension (see METRICS_ENABLED)
+    stage_metrics = None
 
-        self.query = query
+    def __init__(self, query='', lang='', crawl_user=False, top_tweet=False, dedup=None,
+                 since=None, until=None, window_days=None, split_pages=None, resume=False,
+                 max_pages=None, max_tweets=None, until_id=None, queries=None, query_file=None,
+                 extractor=None, archive=None, incremental=False, compact=None, shared_dedup=None):
+
+        # one or many queries, every query is crawled as its own pagination chain(s)
+        self.queries = self.read_queries(query, queries, query_file)
+        self.query = self.queries[0] if self.queries else ''
         self.url = "https://twitter.com/i/search/timeline?l={}".format(lang)
 
         if not top_tweet:
@@ -35,43 +50,380 @@ class TweetScraper(CrawlSpider):
 
         self.crawl_user = crawl_user
 
+        # yield tweets as CompactTweet records instead of Tweet items
+        self.compact = to_bool(compact if compact is not None else settings.getbool('COMPACT_ITEMS'))
+
+        # users already emitted recently are not extracted and written again
+        self.recent_users = None
+        if settings.getint('USER_CACHE_SIZE'):
+            self.recent_users = LRUCache(settings.getint('USER_CACHE_SIZE'), settings.getfloat('USER_CACHE_TTL'))
+
+        # 'selector': parse with scrapy selectors, 'lxml': with the precompiled LxmlTweetExtractor
+        self.extractor = None
+        extractor = extractor or settings.get('TWEET_EXTRACTOR', 'selector')
+        if extractor == 'lxml':
+            self.extractor = LxmlTweetExtractor()
+        elif extractor != 'selector':
+            raise ValueError("Unknown extractor: %s" % extractor)
+
+        # skip tweets seen in this or earlier crawls right after reading their ID
+        self.seen_tweets = None
+        if to_bool(dedup if dedup is not None else settings.getbool('DEDUP_ENABLED')):
+            self.dedup_path = settings['DEDUP_PATH']
+            mkdirs(os.path.dirname(self.dedup_path) or '.')
+            self.seen_tweets = BloomFilter.load(self.dedup_path, settings.getint('DEDUP_CAPACITY'),
+                                                settings.getfloat('DEDUP_ERROR_RATE'))
+
+        # skip tweets which a parallel crawl on this host has claimed first
+        self.shared_seen = None
+        if to_bool(shared_dedup if shared_dedup is not None else settings.getbool('SHARED_DEDUP_ENABLED')):
+            self.shared_seen = SharedDedupStore(settings['SHARED_DEDUP_PATH'])
+
+        # shard the query into since:/until: windows which are crawled as parallel chains
+        self.window_days = int(window_days or settings.getint('SHARD_WINDOW_DAYS'))
+        self.split_pages = int(split_pages or settings.getint('SHARD_SPLIT_PAGES'))
+        self.since = since
+        self.until = until or (datetime.utcnow().date() + timedelta(days=1)).isoformat()
+        if self.window_days and not self.since:
+            raise ValueError("Sharding with window_days requires a `since` date")
+
+        # checkpoint the cursor of every chain so that `-a resume=True` continues a crawl
+        self.resume = to_bool(resume)
+        self.checkpoints = None
+        if settings.getbool('CHECKPOINT_ENABLED') or self.resume:
+            self.checkpoints = CheckpointStore(settings['CHECKPOINT_PATH'])
+
+        # when to stop: `max_pages` per chain, `max_tweets` for the whole crawl, and
+        # `until_id` stops a chain once a page holds only tweets at or below that ID
+        self.max_pages = int(max_pages or settings.getint('MAX_PAGES'))
+        self.max_tweets = int(max_tweets or settings.getint('MAX_TWEETS'))
+        self.max_empty_pages = settings.getint('MAX_EMPTY_PAGES')
+        self.until_id = int(until_id) if until_id else None
+        self.tweet_count = 0
+
+        # incremental: every query stops at the newest tweet already stored for it (its watermark)
+        self.incremental = to_bool(incremental)
+        self.until_ids = {}
+
+        # record the raw pages so that they can be re-parsed later (see TweetScraper.replay)
+        self.archive = None
+        if to_bool(archive if archive is not None else settings.getbool('ARCHIVE_ENABLED')):
+            self.archive = ResponseArchive(settings['ARCHIVE_PATH'])
+
+    @staticmethod
+    def read_queries(query='', queries=None, query_file=None):
+        ''' collect the queries of `-a query=...`, `-a queries="a;b"` and `-a query_file=path` '''
+        collected = [query] if query else []
+        if queries:
+            collected.extend(queries.split(settings.get('QUERY_SEPARATOR', ';')))
+        if query_file:
+            with open(query_file, encoding='utf-8', mode='r') as f:
+                collected.extend(f.read().splitlines())
+
+        result = []
+        for q in collected:
+            q = q.strip()
+            if q and q not in result:
+                result.append(q)
+        return result
+
     def start_requests(self):
-        url = self.url % (quote(self.query), '')
-        yield http.Request(url, callback=self.parse_page)
+        for query in self.queries:
+            for request in self.start_query(query):
+                yield request
+
+    def start_query(self, query):
+        if self.incremental:
+            watermark = self.lookup_watermark(query)
+            if watermark is not None:
+                logger.info("Crawling tweets newer than %d for query:%s" % (watermark, query))
+                self.until_ids[query] = max(watermark, self.until_id or 0)
+        if self.resume:
+            chains = self.checkpoints.chains(query)
+            if chains is not None:
+                logger.info("Resuming %d unfinished chains of query:%s" % (len(chains), query))
+                self.crawler.stats.inc_value('checkpoint/resumed_chains', len(chains))
+                for window, position, pages in chains:
+                    yield self.page_request(query, window, position, pages)
+                return
+        if self.checkpoints is not None:
+            self.checkpoints.reset(query)
+
+        for window in self.windows():
+            self.checkpoint(query, window, '')
+            yield self.page_request(query, window, '')
+
+    def lookup_watermark(self, query):
+        ''' output: the newest tweet ID stored for `query` by any of the pipelines, or None
+
+            Asks every enabled pipeline which implements `watermark(query)`.
+        '''
+        engine = getattr(self.crawler, 'engine', None)
+        if engine is None:
+            return None
+        watermarks = []
+        for pipeline in engine.scraper.itemproc.middlewares:
+            if hasattr(pipeline, 'watermark'):
+                watermark = pipeline.watermark(query)
+                if watermark is not None:
+                    watermarks.append(int(watermark))
+        if not watermarks:
+            logger.info("No stored tweets for query:%s, crawling all of it" % query)
+            return None
+        return max(watermarks)
+
+    def page_context(self, query):
+        ''' the per page state of `parse_tweets_block`, see `parse_tweet_item` '''
+        return {'query': query, 'tweets': 0, 'new': 0, 'old': 0, 'shared': 0,
+                'until_id': self.until_ids.get(query, self.until_id)}
+
+    def checkpoint(self, query, window, position, pages=0):
+        if self.checkpoints is not None:
+            self.checkpoints.save(query, window, position, pages)
+
+    def windows(self):
+        ''' split [since, until) into `window_days` wide (since, until) windows, newest first '''
+        if not self.window_days:
+            return [None]
+
+        since = datetime.strptime(self.since, '%Y-%m-%d').date()
+        until = datetime.strptime(self.until, '%Y-%m-%d').date()
+        windows = []
+        while until > since:
+            start = max(since, until - timedelta(days=self.window_days))
+            windows.append((start.isoformat(), until.isoformat()))
+            until = start
+        self.crawler.stats.inc_value('shard/windows', len(windows))
+        return windows
+
+    def search_query(self, query, window):
+        if window is None:
+            return query
+        return '%s since:%s until:%s' % (query, window[0], window[1])
+
+    def page_request(self, query, window, position, pages=0, empty_pages=0):
+        url = self.url % (quote(self.search_query(query, window)), position)
+        return http.Request(url, callback=self.parse_page,
+                            meta={'query': query, 'window': window, 'position': position,
+                                  'pages': pages, 'empty_pages': empty_pages})
 
     def parse_page(self, response):
         # inspect_response(response, self)
         # handle current page
+        query = response.meta.get('query', self.query)
+        metrics = self.stage_metrics
+        profiled = metrics is not None and metrics.start_profile()
+
+        start = time.time()
         data = json.loads(response.body.decode("utf-8"))
-        for item in self.parse_tweets_block(data['items_html']):
+        self.observe_stage('decode', query, start)
+        if self.archive is not None:
+            self.archive.record(query, response.meta.get('window'), response.meta.get('position'), data)
+            self.crawler.stats.inc_value('archive/pages')
+
+        # extract the whole page before yielding, so the pipelines are not timed as extraction
+        start = time.time()
+        context = self.page_context(query)
+        items = list(self.parse_tweets_block(data['items_html'], context))
+        self.observe_stage('extract', query, start)
+        if profiled:
+            metrics.stop_profile()
+
+        for item in items:
             yield item
 
+        window = response.meta.get('window')
+        pages = response.meta.get('pages', 0) + 1
+        # tweets claimed by a parallel crawl are new as well, they are only written by that crawl
+        empty_pages = response.meta.get('empty_pages', 0) + 1 if not (context['new'] or context['shared']) else 0
+
+        reason = self.stop_reason(response, data, context, pages, empty_pages)
+        if reason:
+            self.finish_chain(query, window, reason)
+            if self.max_tweets and self.tweet_count >= self.max_tweets:
+                raise CloseSpider('max_tweets')
+            return
+
+        if window is not None and self.split_pages and pages >= self.split_pages:
+            # this window is large, continue what is left of it as two parallel chains
+            windows = self.split_window(window, data['items_html'])
+            if windows:
+                for subwindow in windows:
+                    self.checkpoint(query, subwindow, '')
+                    yield self.page_request(query, subwindow, '')
+                if self.checkpoints is not None:
+                    self.checkpoints.finish(query, window)
+                return
+
         # get next page
         min_position = data['min_position']
-        url = self.url % (quote(self.query), min_position)
-        yield http.Request(url, callback=self.parse_page)
+        self.checkpoint(query, window, min_position, pages)
+        yield self.page_request(query, window, min_position, pages, empty_pages)
+
+    def observe_stage(self, stage, query, start):
+        if self.stage_metrics is not None:
+            self.stage_metrics.observe(stage, query, time.time() - start)
+
+    def stop_reason(self, response, data, context, pages, empty_pages):
+        ''' output: why the chain of `response` ends after this page, or None to continue '''
+        if self.max_tweets and self.tweet_count >= self.max_tweets:
+            return 'max_tweets'
+        if not context['tweets']:
+            if data.get('has_more_items') or \
+                    (data.get('min_position') and data['min_position'] != response.meta.get('position')):
+                # throttled, not the end of the results: the checkpoint stays open for a resume
+                return 'throttled'
+            return 'empty_page'
+        if data.get('has_more_items') is False:
+            return 'no_more_items'
+        if not data.get('min_position') or data['min_position'] == response.meta.get('position'):
+            return 'repeated_cursor'
+        if context.get('until_id') and context['old'] == context['tweets']:
+            return 'until_id'
+        if self.max_pages and pages >= self.max_pages:
+            return 'max_pages'
+        if self.max_empty_pages and empty_pages >= self.max_empty_pages:
+            return 'no_new_tweets'
+        return None
+
+    def finish_chain(self, query, window, reason):
+        logger.info("Finished %s: %s" % (self.search_query(query, window), reason))
+        self.crawler.stats.inc_value('finish/stop_reason/%s' % reason)
+        if reason == 'throttled':
+            logger.warning("Stopped %s on a throttled page, resume the crawl to continue it"
+                           % self.search_query(query, window))
+        elif self.checkpoints is not None:
+            self.checkpoints.finish(query, window)
+
+    def split_window(self, window, html_page):
+        ''' halve the part of `window` which is older than the tweets on the current page '''
+        times = [int(t) for t in re.findall(r'data-time="(\d+)"', html_page)]
+        if not times:
+            return None
+
+        since = datetime.strptime(window[0], '%Y-%m-%d').date()
+        until = datetime.strptime(window[1], '%Y-%m-%d').date()
+        # `until:` is exclusive, keep the day of the oldest tweet
+        oldest = datetime.utcfromtimestamp(min(times)).date() + timedelta(days=1)
+        until = min(until, oldest)
+        days = (until - since).days
+        if days < 2:
+            return None
+
+        middle = since + timedelta(days=days // 2)
+        self.crawler.stats.inc_value('shard/splits')
+        self.crawler.stats.inc_value('shard/windows', 2)
+        return [(middle.isoformat(), until.isoformat()), (since.isoformat(), middle.isoformat())]
+
+    def parse_tweets_block(self, html_page, context=None):
+        if self.shared_seen is not None and context is not None:
+            # claim the whole page with one transaction before parsing any tweet of it
+            context['claimable'] = set(re.findall(r'data-tweet-id="(\d+)"', html_page))
+            context['claimed'] = self.shared_seen.claim(context['claimable'], context['query'])
+
+        if self.extractor is not None:
+            for item in self.parse_tweet_nodes(self.extractor.tweet_nodes(html_page), context):
+                yield item
+            return
 
-    def parse_tweets_block(self, html_page):
         page = Selector(text=html_page)
 
         ### for text only tweets
         items = page.xpath('//li[@data-item-type="tweet"]/div')
-        for item in self.parse_tweet_item(items):
+        for item in self.parse_tweet_item(items, context):
             yield item
 
-    def parse_tweet_item(self, items):
-        for item in items:
+    def accept_tweet(self, ID, context):
+        ''' decide right after reading the ID whether a tweet is parsed at all '''
+        context['tweets'] += 1
+        if context.get('until_id') and int(ID) <= context['until_id']:
+            context['old'] += 1
+            return False
+        if self.seen_tweets is not None:
+            if ID in self.seen_tweets:
+                self.crawler.stats.inc_value('dedup/hits')
+                return False
+            self.crawler.stats.inc_value('dedup/misses')
+        if 'claimed' in context:
+            if ID not in context['claimable']:
+                context['claimed'] |= self.shared_seen.claim([ID], context['query'])
+            if ID not in context['claimed']:
+                context['shared'] += 1
+                self.crawler.stats.inc_value('shared_dedup/hits')
+                return False
+            self.crawler.stats.inc_value('shared_dedup/misses')
+        return True
+
+    def emit_tweet(self, tweet, context):
+        if self.seen_tweets is not None:
+            self.seen_tweets.add(tweet['ID'])
+        context['new'] += 1
+        self.tweet_count += 1
+        return tweet
+
+    def make_tweet(self, fields):
+        ''' output: a `CompactTweet`, or a `Tweet` with the local `datetime` of `timestamp` '''
+        if self.compact:
+            return CompactTweet(fields)
+        timestamp = fields.pop('timestamp')
+        tweet = Tweet(fields)
+        tweet['datetime'] = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        return tweet
+
+    def want_user(self, user_id):
+        ''' output: False if the user was emitted recently and can be skipped '''
+        if self.recent_users is None:
+            return True
+        if self.recent_users.seen(user_id):
+            self.crawler.stats.inc_value('user_cache/hits')
+            return False
+        self.crawler.stats.inc_value('user_cache/misses')
+        return True
+
+    def parse_tweet_nodes(self, nodes, context=None):
+        ''' same as `parse_tweet_item`, for the lxml nodes of `self.extractor` '''
+        if context is None:
+            context = self.page_context(self.query)
+        for node in nodes:
+            ID = None
             try:
-                tweet = Tweet()
+                ID = self.extractor.tweet_id(node)
+                if not ID or not self.accept_tweet(ID, context):
+                    continue
 
-                tweet['query'] = self.query
-                tweet['usernameTweet'] = item.xpath('.//span[@class="username u-dir u-textTruncate"]/b/text()').extract()[0]
+                tweet = self.extractor.tweet_fields(node, ID)
+                if tweet is None:
+                    # If there is not text, we ignore the tweet
+                    continue
+                tweet['ID'] = ID
+                tweet['query'] = context['query']
+                yield self.emit_tweet(self.make_tweet(tweet), context)
+
+                if self.crawl_user and self.want_user(tweet['user_id']):
+                    yield User(self.extractor.user_fields(node, tweet['user_id']))
+            except:
+                logger.error("Error tweet:%s" % ID, exc_info=True)
+
+    def parse_tweet_item(self, items, context=None):
+        ''' context - optional dict with the `query` and `until_id` of the page (see `page_context`);
+                      the number of tweets found on the page (`tweets`), the ones at or below
+                      `until_id` (`old`), the yielded ones (`new`) and the ones claimed by a
+                      parallel crawl (`shared`) are counted in it
+        '''
+        if context is None:
+            context = self.page_context(self.query)
+        for item in items:
+            try:
+                tweet = {} # the fields, see make_tweet
 
                 ID = item.xpath('.//@data-tweet-id').extract()
-                if not ID:
+                if not ID or not self.accept_tweet(ID[0], context):
                     continue
                 tweet['ID'] = ID[0]
 
+                tweet['query'] = context['query']
+                tweet['usernameTweet'] = item.xpath('.//span[@class="username u-dir u-textTruncate"]/b/text()').extract()[0]
+
                 ### get text content
                 tweet['text'] = ' '.join(
                     item.xpath('.//div[@class="js-tweet-text-container"]/p//text()').extract()).replace(' # ',
@@ -105,9 +457,9 @@ class TweetScraper(CrawlSpider):
                 else:
                     tweet['nbr_reply'] = 0
 
-                tweet['datetime'] = datetime.fromtimestamp(int(
+                tweet['timestamp'] = int(
                     item.xpath('.//div[@class="stream-item-header"]/small[@class="time"]/a/span/@data-time').extract()[
-                        0])).strftime('%Y-%m-%d %H:%M:%S')
+                        0])
 
                 ### get photo
                 has_cards = item.xpath('.//@data-card-type').extract()
@@ -149,9 +501,9 @@ class TweetScraper(CrawlSpider):
                 tweet['is_retweet'] = is_retweet != []
 
                 tweet['user_id'] = item.xpath('.//@data-user-id').extract()[0]
-                yield tweet
+                yield self.emit_tweet(self.make_tweet(tweet), context)
 
-                if self.crawl_user:
+                if self.crawl_user and self.want_user(tweet['user_id']):
                     ### get user info
                     user = User()
                     user['ID'] = tweet['user_id']
@@ -164,6 +516,24 @@ class TweetScraper(CrawlSpider):
                 logger.error("Error tweet:\n%s" % item.xpath('.').extract()[0])
                 # raise
 
+    def closed(self, reason):
+        if self.archive is not None:
+            self.archive.close()
+        if self.shared_seen is not None:
+            self.shared_seen.close()
+            stats = self.crawler.stats
+            lookups = stats.get_value('shared_dedup/hits', 0) + stats.get_value('shared_dedup/misses', 0)
+            if lookups:
+                stats.set_value('shared_dedup/hit_rate', stats.get_value('shared_dedup/hits', 0) / float(lookups))
+        if self.checkpoints is not None:
+            self.checkpoints.close()
+        if self.seen_tweets is not None:
+            self.seen_tweets.save(self.dedup_path)
+            stats = self.crawler.stats
+            lookups = stats.get_value('dedup/hits', 0) + stats.get_value('dedup/misses', 0)
+            if lookups:
+                stats.set_value('dedup/hit_rate', stats.get_value('dedup/hits', 0) / float(lookups))
+
     def extract_one(self, selector, xpath, default=None):
         extracted = selector.xpath(xpath).extract()
         if extracted:
@@ -3,4 +3,16 @@ import os
 def mkdirs(dirs):
     ''' Create `dirs` if not exist. '''
     if not os.path.exists(dirs):
-        os.makedirs(dirs)
\ No newline at end of file
+        try:
+            os.makedirs(dirs)
+        except OSError:
+            # created by a parallel process in the meantime
+            if not os.path.isdir(dirs):
+                raise
+
+
+def to_bool(value):
+    ''' Interpret spider arguments like `-a resume=False` which arrive as strings. '''
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
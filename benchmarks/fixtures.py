@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+''' Synthetic /i/search/timeline responses in the markup the spider parses.
+
+    python -m benchmarks.fixtures -o fixtures/ --pages 100 --tweets 20 --cards mixed
+
+writes one `page-<n>.json` per page which can be fed to `benchmarks/parse_benchmark.py`,
+next to responses recorded from twitter.com.
+'''
+import argparse
+import json
+import os
+import random
+
+TWEET = (
+    '<li class="js-stream-item stream-item stream-item" data-item-id="{id}" id="stream-item-tweet-{id}" data-item-type="tweet">'
+    '<div class="tweet js-stream-tweet js-actionable-tweet js-profile-popup-actionable dismissible-content original-tweet js-original-tweet"'
+    ' data-tweet-id="{id}" data-item-id="{id}" data-permalink-path="/{screen_name}/status/{id}" data-conversation-id="{id}"'
+    ' data-screen-name="{screen_name}" data-name="{name}" data-user-id="{user_id}">'
+    '<div class="context">{retweet}</div>'
+    '<div class="content">'
+    '<div class="stream-item-header">'
+    '<a class="account-group js-account-group js-action-profile js-user-profile-link js-nav" href="/{screen_name}" data-user-id="{user_id}">'
+    '<img class="avatar js-action-profile-avatar" src="https://pbs.twimg.com/profile_images/{user_id}/photo_bigger.jpg" alt="">'
+    '<span class="FullNameGroup"><strong class="fullname show-popup-with-id u-textTruncate">{name}</strong></span>'
+    '<span class="username u-dir u-textTruncate" dir="ltr">@<b>{screen_name}</b></span></a>'
+    '<small class="time"><a href="/{screen_name}/status/{id}" class="tweet-timestamp js-permalink js-nav js-tooltip">'
+    '<span class="_timestamp js-short-timestamp" data-aria-label-part="last" data-time="{time}" data-time-ms="{time}000"'
+    ' data-long-form="true">{time}</span></a></small></div>'
+    '{reply}'
+    '<div class="js-tweet-text-container"><p class="TweetTextSize  js-tweet-text tweet-text" lang="en" data-aria-label-part="0">'
+    '{text} <a href="/hashtag/{tag}?src=hash" class="twitter-hashtag pretty-link js-nav" dir="ltr"><s>#</s><b>{tag}</b></a>'
+    ' <a href="/{mention}" class="twitter-atreply pretty-link js-nav" dir="ltr"><s>@</s><b>{mention}</b></a></p></div>'
+    '{card}'
+    '<div class="stream-item-footer"><div class="ProfileTweet-actionCountList u-hiddenVisually">'
+    '<span class="ProfileTweet-action--reply u-hiddenVisually"><span class="ProfileTweet-actionCount" data-tweet-stat-count="{replies}">'
+    '<span class="ProfileTweet-actionCountForAria">{replies} replies</span></span></span>'
+    '<span class="ProfileTweet-action--retweet u-hiddenVisually"><span class="ProfileTweet-actionCount" data-tweet-stat-count="{retweets}">'
+    '<span class="ProfileTweet-actionCountForAria">{retweets} retweets</span></span></span>'
+    '<span class="ProfileTweet-action--favorite u-hiddenVisually"><span class="ProfileTweet-actionCount" data-tweet-stat-count="{favorites}">'
+    '<span class="ProfileTweet-actionCountForAria">{favorites} likes</span></span></span>'
+    '</div></div></div></div></li>'
+)
+
+PHOTO = ('<div class="AdaptiveMediaOuterContainer"><div class="AdaptiveMedia is-square" data-card-type="photo">'
+         '<div class="AdaptiveMedia-container"><div class="AdaptiveMedia-singlePhoto">'
+         '<div class="AdaptiveMedia-photoContainer js-adaptive-photo" data-image-url="https://pbs.twimg.com/media/{media}.jpg">'
+         '<img data-aria-label-part src="https://pbs.twimg.com/media/{media}.jpg" alt=""></div></div></div></div></div>')
+GIF = ('<div class="card2 js-media-container" data-card2-type="animated_gif"><div class="PlayableMedia">'
+       '<video class="animated-gif"><source video-src="https://video.twimg.com/tweet_video/{media}.mp4" type="video/mp4">'
+       '</video></div></div>')
+PLAYER = ('<div class="card2 js-media-container" data-card2-type="player" data-card2-name="player">'
+          '<div class="js-macaw-cards-iframe-container" data-card-url="https://twitter.com/i/cards/tfw/v1/{id}"></div></div>')
+
+RETWEET = '<span class="js-retweet-text">Someone Retweeted</span>'
+REPLY = '<div class="ReplyingToContextBelowAuthor" data-aria-label-part="">Replying to @someone</div>'
+
+WORDS = ('the quick brown fox jumps over a lazy dog while tweeting about scraping twitter search results '
+         'with scrapy and mongodb in docker containers near berlin hamburg munich cologne').split()
+
+
+def tweet_html(rnd, tweet_id, timestamp, cards):
+    ''' cards - 'none', 'mixed' or one of 'photo', 'gif', 'player' '''
+    card = cards
+    if cards == 'mixed':
+        card = rnd.choice(('none', 'none', 'photo', 'gif', 'player'))
+    media = '%x' % rnd.getrandbits(48)
+    user_id = rnd.randint(10 ** 6, 10 ** 9)
+    return TWEET.format(
+        id=tweet_id, user_id=user_id, screen_name='user%d' % user_id, name='User %d' % user_id,
+        time=timestamp, text=' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 30))),
+        tag=rnd.choice(WORDS), mention=rnd.choice(WORDS),
+        retweet=RETWEET if rnd.random() < 0.2 else '', reply=REPLY if rnd.random() < 0.3 else '',
+        card={'photo': PHOTO, 'gif': GIF, 'player': PLAYER}.get(card, '').format(media=media, id=tweet_id),
+        replies=rnd.randint(0, 50), retweets=rnd.randint(0, 500), favorites=rnd.randint(0, 5000))
+
+
+def generate_pages(pages=10, tweets_per_page=20, cards='mixed', seed=0):
+    ''' output: a list of response bodies (bytes), newest page first, like a real crawl '''
+    rnd = random.Random(seed)
+    tweet_id = 990000000000000000
+    timestamp = 1525000000
+    bodies = []
+    for page in range(pages):
+        items = []
+        for _ in range(tweets_per_page):
+            tweet_id -= rnd.randint(1, 10 ** 9)
+            timestamp -= rnd.randint(1, 120)
+            items.append(tweet_html(rnd, tweet_id, timestamp, cards))
+        bodies.append(json.dumps({
+            'min_position': 'TWEET-%d-%d' % (tweet_id, tweet_id + 10 ** 12),
+            'has_more_items': page < pages - 1,
+            'items_html': '\n'.join(items),
+            'new_latent_count': tweets_per_page,
+        }).encode('utf-8'))
+    return bodies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic timeline responses.")
+    parser.add_argument('-o', dest='out', required=True, help="Directory to write the page-<n>.json files to.")
+    parser.add_argument('--pages', type=int, default=100)
+    parser.add_argument('--tweets', type=int, default=20, help="Tweets per page.")
+    parser.add_argument('--cards', default='mixed', choices=('none', 'mixed', 'photo', 'gif', 'player'))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.out):
+        os.makedirs(args.out)
+    for n, body in enumerate(generate_pages(args.pages, args.tweets, args.cards, args.seed)):
+        with open(os.path.join(args.out, 'page-%05d.json' % n), 'wb') as f:
+            f.write(body)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+''' Offline benchmark of the parse path and the pipelines, no network needed.
+
+Feeds timeline responses through `TweetScraper.parse_page` -> `parse_tweets_block` ->
+`parse_tweet_item` and the given pipelines, and reports tweets per second, the time per
+stage and the memory allocated per page. Run it from the project root:
+
+    python -m benchmarks.parse_benchmark --pages 200 --tweets 20 --cards mixed
+    python -m benchmarks.parse_benchmark -f recorded/ --extractor lxml
+    python -m benchmarks.parse_benchmark --pipeline TweetScraper.pipelines.SaveToFilePipeline
+
+`-f` takes a directory of recorded (or `benchmarks.fixtures` generated) responses, one
+`*.json` or `*.json.gz` body per file.
+'''
+import argparse
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from scrapy.http import Request
+
+from benchmarks.fixtures import generate_pages
+from TweetScraper import offline
+from TweetScraper.items import TWEET_TYPES
+
+
+def load_pages(path):
+    bodies = []
+    for fname in sorted(os.listdir(path)):
+        fpath = os.path.join(path, fname)
+        if fname.endswith('.json.gz'):
+            with gzip.open(fpath, 'rb') as f:
+                bodies.append(f.read())
+        elif fname.endswith('.json'):
+            with open(fpath, 'rb') as f:
+                bodies.append(f.read())
+    return bodies
+
+
+def run_stages(spider, pipelines, bodies):
+    ''' the steps of `parse_page` one by one, output: seconds per stage and the tweet count '''
+    timings = {'decode': 0.0, 'parse': 0.0, 'pipeline': 0.0}
+    tweets = 0
+    for body in bodies:
+        start = time.perf_counter()
+        data = json.loads(body.decode('utf-8'))
+        decoded = time.perf_counter()
+        context = spider.page_context(spider.query)
+        items = list(spider.parse_tweets_block(data['items_html'], context))
+        parsed = time.perf_counter()
+        for item in items:
+            offline.process_item(pipelines, item, spider)
+        written = time.perf_counter()
+
+        timings['decode'] += decoded - start
+        timings['parse'] += parsed - decoded
+        timings['pipeline'] += written - parsed
+        tweets += context['new']
+    return timings, tweets
+
+
+def run_parse_page(spider, pipelines, bodies):
+    ''' `parse_page` end to end, output: seconds and the tweet count '''
+    tweets = 0
+    start = time.perf_counter()
+    for body in bodies:
+        for item in spider.parse_page(offline.timeline_response(spider, body)):
+            if isinstance(item, Request):
+                continue
+            if isinstance(item, TWEET_TYPES):
+                tweets += 1
+            offline.process_item(pipelines, item, spider)
+    return time.perf_counter() - start, tweets
+
+
+def measure_memory(spider, bodies):
+    ''' output: mean and max bytes allocated at peak while parsing one page '''
+    peaks = []
+    tracemalloc.start()
+    for body in bodies:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        items = list(spider.parse_page(offline.timeline_response(spider, body)))
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        del items
+    tracemalloc.stop()
+    return sum(peaks) / float(len(peaks)), max(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline parser and pipeline benchmark.")
+    parser.add_argument('-f', dest='fixtures', help="Directory with recorded timeline responses.")
+    parser.add_argument('--pages', type=int, default=100, help="Synthetic pages (without -f).")
+    parser.add_argument('--tweets', type=int, default=20, help="Synthetic tweets per page (without -f).")
+    parser.add_argument('--cards', default='mixed', choices=('none', 'mixed', 'photo', 'gif', 'player'))
+    parser.add_argument('--extractor', default='selector', choices=('selector', 'lxml'))
+    parser.add_argument('--crawl-user', action='store_true')
+    parser.add_argument('--pipeline', action='append', default=[],
+                        help="Pipeline class to write the items with, can be given multiple times.")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement, the best one is reported.")
+    parser.add_argument('--json', dest='json_out', help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    if args.fixtures:
+        bodies = load_pages(args.fixtures)
+    else:
+        bodies = generate_pages(args.pages, args.tweets, args.cards)
+    if not bodies:
+        parser.error("No timeline responses found.")
+
+    # file based pipelines write into a scratch directory
+    scratch = tempfile.mkdtemp(prefix='tweetscraper-bench-')
+    overrides = {'DEDUP_ENABLED': False, 'MAX_EMPTY_PAGES': 0,
+                 'SAVE_TWEET_PATH': os.path.join(scratch, 'tweet'),
+                 'SAVE_USER_PATH': os.path.join(scratch, 'user'),
+                 'SAVE_WATERMARKS_PATH': os.path.join(scratch, 'watermarks.json')}
+
+    def fresh_spider():
+        # a new spider per run, so that every run starts with an empty user cache
+        # (`USER_CACHE_SIZE`) and does the same work
+        return offline.build_spider(overrides, query='benchmark', extractor=args.extractor,
+                                    crawl_user=args.crawl_user)
+
+    try:
+        results = {'pages': len(bodies), 'bytes': sum(len(body) for body in bodies),
+                   'extractor': args.extractor, 'pipelines': args.pipeline}
+
+        best = None
+        for _ in range(args.repeat):
+            spider = fresh_spider()
+            pipelines = offline.open_pipelines(spider, args.pipeline)
+            timings, tweets = run_stages(spider, pipelines, bodies)
+            offline.close_pipelines(pipelines, spider)
+            if best is None or sum(timings.values()) < sum(best.values()):
+                best = timings
+        results['tweets'] = tweets
+        results['stages'] = best
+
+        seconds = None
+        for _ in range(args.repeat):
+            spider = fresh_spider()
+            pipelines = offline.open_pipelines(spider, args.pipeline)
+            elapsed, _ = run_parse_page(spider, pipelines, bodies)
+            offline.close_pipelines(pipelines, spider)
+            seconds = elapsed if seconds is None else min(seconds, elapsed)
+        results['parse_page_seconds'] = seconds
+        results['tweets_per_second'] = tweets / seconds if seconds else 0
+        results['pages_per_second'] = len(bodies) / seconds if seconds else 0
+        results['memory_per_page_mean'], results['memory_per_page_max'] = measure_memory(fresh_spider(), bodies)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    print("pages:            %d (%.1f KB)" % (results['pages'], results['bytes'] / 1024.0))
+    print("tweets:           %d" % results['tweets'])
+    print("extractor:        %s" % results['extractor'])
+    print("pipelines:        %s" % (', '.join(results['pipelines']) or '-'))
+    for stage, seconds in sorted(best.items()):
+        print("%-17s %.2f ms/page" % (stage + ':', 1000.0 * seconds / len(bodies)))
+    print("parse_page:       %.0f tweets/s, %.1f pages/s" % (results['tweets_per_second'], results['pages_per_second']))
+    print("memory per page:  %.0f KB mean, %.0f KB max" % (results['memory_per_page_mean'] / 1024.0,
+                                                           results['memory_per_page_max'] / 1024.0))
+
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
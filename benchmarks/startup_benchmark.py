@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+''' Cold start benchmark of a crawl process, no network needed.
+
+Every run starts a fresh interpreter, like each container or worker process the bootstrap
+fans out, loads scrapy and the project, and builds the spider and the pipelines of
+ITEM_PIPELINES (or `--pipeline`) through `from_crawler`. The pipelines are not opened, so
+no database has to be running. `--eager` imports the client packages of all backends up
+front, the way `TweetScraper.pipelines` did at module level, for comparison. Run it from
+the project root:
+
+    python -m benchmarks.startup_benchmark --runs 10
+    python -m benchmarks.startup_benchmark --runs 10 --eager
+    python -m benchmarks.startup_benchmark --pipeline TweetScraper.pipelines.SaveToFilePipeline
+'''
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+
+def child(paths, eager):
+    ''' one cold start, prints the seconds per step and the loaded backends as JSON '''
+    timings = {}
+    start = time.perf_counter()
+    import scrapy.crawler
+    timings['scrapy'] = time.perf_counter() - start
+
+    step = time.perf_counter()
+    from scrapy.exceptions import NotConfigured
+    from scrapy.utils.misc import load_object
+    from TweetScraper import offline, pipelines
+    if eager:
+        for name in pipelines.BACKENDS:
+            try:
+                pipelines.import_backend(name)
+            except ImportError:
+                pass
+    spider = offline.build_spider(query='benchmark')
+    if not paths:
+        enabled = spider.crawler.settings.getdict('ITEM_PIPELINES')
+        paths = sorted(enabled, key=enabled.get)
+    for path in paths:
+        try:
+            load_object(path).from_crawler(spider.crawler)
+        except (NotConfigured, ImportError):
+            pass
+    timings['project'] = time.perf_counter() - step
+    timings['total'] = time.perf_counter() - start
+
+    loaded = [name for name, modules in sorted(pipelines.BACKENDS.items()) if modules[0] in sys.modules]
+    print(json.dumps({'timings': timings, 'backends': loaded, 'pipelines': paths}))
+
+
+def cold_start(paths, eager):
+    ''' output: the wall time of one fresh process and what it reported '''
+    command = [sys.executable, '-m', 'benchmarks.startup_benchmark', '--child']
+    for path in paths:
+        command += ['--pipeline', path]
+    if eager:
+        command.append('--eager')
+    start = time.perf_counter()
+    output = subprocess.check_output(command)
+    wall = time.perf_counter() - start
+    return wall, json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark of a crawl process.")
+    parser.add_argument('--pipeline', action='append', default=[],
+                        help="Pipeline class to build, can be given multiple times (default: ITEM_PIPELINES).")
+    parser.add_argument('--runs', type=int, default=5, help="Fresh processes to start, the median is reported.")
+    parser.add_argument('--eager', action='store_true', help="Import the clients of all backends up front.")
+    parser.add_argument('--json', dest='json_out', help="Also write the results to this file.")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.pipeline, args.eager)
+        return
+
+    walls = []
+    reports = []
+    for _ in range(max(1, args.runs)):
+        wall, report = cold_start(args.pipeline, args.eager)
+        walls.append(wall)
+        reports.append(report)
+
+    results = {'runs': len(walls), 'eager': args.eager, 'pipelines': reports[0]['pipelines'],
+               'backends': reports[0]['backends'], 'process_seconds': median(walls)}
+    for step in ('scrapy', 'project', 'total'):
+        results[step + '_seconds'] = median([report['timings'][step] for report in reports])
+
+    print("pipelines:        %s" % (', '.join(results['pipelines']) or '-'))
+    print("backends loaded:  %s" % (', '.join(results['backends']) or '-'))
+    print("process:          %.0f ms (interpreter start to exit)" % (1000 * results['process_seconds']))
+    print("scrapy import:    %.0f ms" % (1000 * results['scrapy_seconds']))
+    print("project startup:  %.0f ms (spider, pipelines and backends)" % (1000 * results['project_seconds']))
+    print("runs:             %d%s" % (results['runs'], ', eager backend imports' if args.eager else ''))
+
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import multiprocessing
+import re
+import threading
+import time
+
+
+class QueryScheduler(object):
+    """
+    Base class of the schedulers: collects the result of every scrape and logs the summary.
+    """
+
+    def __init__(self, max_parallel, retries, logger):
+        self.max_parallel = max(1, max_parallel)
+        self.retries = max(0, retries)
+        self.logger = logger
+
+        # scrapy settings which are overridden for every scrape, like `-s NAME=VALUE`
+        self.settings = dict()
+
+        self.results = list()
+        self.lock = threading.Lock()
+        self.started = None
+
+    def finished(self, name, spider_args, status, attempts, start):
+        """
+        Records the result of one scrape.
+
+        :return: dict with name, query, exit status, attempts and wall time
+        """
+
+        result = {'name': name, 'query': spider_args, 'status': status, 'attempts': attempts,
+                  'seconds': time.time() - start}
+        with self.lock:
+            self.results.append(result)
+        self.logger.info("Finished " + str(name) + ": exit " + str(status) + " after " + str(attempts)
+                         + " attempt(s), " + "%.0fs" % result['seconds'])
+        return result
+
+    def summary(self):
+        """
+        Logs the wall time and exit status of every scrape.
+
+        :return: None
+        """
+
+        failed = [result for result in self.results if result['status'] != 0]
+        self.logger.info("Ran " + str(len(self.results)) + " scrapes in " + "%.0fs" % (time.time() - self.started)
+                         + " (at most " + str(self.max_parallel) + " at a time), " + str(len(failed)) + " failed")
+        for result in self.results:
+            self.logger.info("%-8s %6.0fs  %d attempt(s)  %s" % (
+                "ok" if result['status'] == 0 else "exit " + str(result['status']),
+                result['seconds'], result['attempts'], result['query']))
+
+
+class ContainerScheduler(QueryScheduler):
+    """
+    Runs the queued scrapes in docker containers, but never more than max_containers at the same time. The next
+    container is only started when a running one has exited, so a bulk run with hundreds of queries does not
+    overload the host (or get its IP throttled). A container which exits with a non-zero status is started again,
+    up to retries times.
+    """
+
+    def __init__(self, docker_client, image="tweetscraper_alpine:latest", max_containers=4, retries=1,
+                 retry_delay=30, volume=None, shared_volume=None, logger=None):
+        """
+        :param docker_client: the client of the docker daemon, e.g. docker.from_env()
+        :param image: the image the containers are started from
+        :param max_containers: how many containers may run at the same time
+        :param retries: how often a failed scrape is started again
+        :param retry_delay: seconds to wait before a failed scrape is started again (grows with every attempt)
+        :param volume: a host path which is mounted (read only) to /home/tweetscraper/
+        :param shared_volume: a host path which is mounted (writable) to /shared/ in all containers
+        :param logger: the logger
+        """
+        super(ContainerScheduler, self).__init__(max_containers, retries, logger)
+        self.docker_client = docker_client
+        self.image = image
+        self.retry_delay = retry_delay
+        self.volume = volume
+        self.shared_volume = shared_volume
+
+        self.executor = None
+        self.jobs = list()
+
+    def command(self, spider_args):
+        """
+        Creates the scrapy command which is run inside the container.
+
+        :param spider_args: dict with the spider arguments, e.g. {"query": "foo"}
+        :return: the command as string
+        """
+
+        temp_command = "scrapy crawl TweetScraper"
+        for key, value in spider_args.items():
+            temp_command += " -a " + key + "=\"" + str(value) + "\""
+        for key, value in self.settings.items():
+            temp_command += " -s " + key + "=\"" + str(value) + "\""
+        return temp_command
+
+    def submit(self, name, spider_args):
+        """
+        Queues one scrape. It is started as soon as less than max_containers containers are running.
+
+        :param name: the name of the scrape, used for the container names and the summary
+        :param spider_args: dict with the spider arguments, e.g. {"query": "foo"}
+        :return: None
+        """
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_parallel)
+            self.started = time.time()
+
+        self.logger.debug("Queued: " + str(name) + " " + str(spider_args))
+        self.jobs.append(self.executor.submit(self.run_job, name, spider_args))
+
+    def run_job(self, name, spider_args):
+        """
+        Runs one scrape in a container until it succeeds or runs out of retries. Called in a worker thread.
+
+        :return: dict with name, query, exit status, attempts and wall time
+        """
+
+        start = time.time()
+        status = None
+        attempt = 0
+        for attempt in range(1, self.retries + 2):
+            status = self.run_container(name, spider_args, attempt)
+            if status == 0:
+                break
+            if attempt <= self.retries:
+                self.logger.warning("Scrape " + str(name) + " exited with " + str(status) + ", retrying ("
+                                    + str(attempt) + "/" + str(self.retries) + ")")
+                time.sleep(self.retry_delay * attempt)
+
+        return self.finished(name, spider_args, status, attempt, start)
+
+    def run_container(self, name, spider_args, attempt):
+        """
+        Starts one container, waits until it exits and removes it.
+
+        :return: the exit status of the container, or None if it could not be run
+        """
+
+        # docker only allows [a-zA-Z0-9_.-] in container names
+        container_name = re.sub(r'[^a-zA-Z0-9_.-]', '_', "tweetscraper_" + str(name) + "_" + str(time.time()) + "_" + str(attempt))
+        temp_command = self.command(spider_args)
+        self.logger.debug("COMMAND: " + str(temp_command))
+
+        # the containers are removed by us, auto_remove would drop the exit status
+        kwargs = dict(image=self.image, detach=True, name=container_name, command=temp_command)
+        if self.volume or self.shared_volume:
+            kwargs['volumes'] = dict()
+        if self.volume:
+            kwargs['volumes'][self.volume] = {
+                'bind': '/home/tweetscraper/',
+                'mode': 'ro'
+            }
+        if self.shared_volume:
+            kwargs['volumes'][self.shared_volume] = {
+                'bind': '/shared/',
+                'mode': 'rw'
+            }
+
+        container = None
+        try:
+            container = self.docker_client.containers.run(**kwargs)
+            return container.wait().get('StatusCode')
+        except Exception as e:
+            self.logger.error("Container " + container_name + " failed: " + str(e))
+            return None
+        finally:
+            if container is not None:
+                try:
+                    container.remove(force=True)
+                except Exception as e:
+                    self.logger.warning("Could not remove container " + container_name + ": " + str(e))
+
+    def wait(self):
+        """
+        Blocks until all queued scrapes have finished and logs a summary.
+
+        :return: list with one result dict per scrape
+        """
+
+        if self.executor is None:
+            return list()
+
+        for job in self.jobs:
+            job.result()
+        self.executor.shutdown()
+        self.executor = None
+        self.jobs = list()
+
+        self.summary()
+        return self.results
+
+
+def run_crawl(spider_args, overrides=None):
+    """
+    Runs one scrape with a CrawlerProcess in this process. The twisted reactor can not be restarted, therefore every
+    scrape needs a fresh worker process (see LocalScheduler).
+
+    :param spider_args: dict with the spider arguments, e.g. {"query": "foo"}
+    :param overrides: dict with scrapy settings to override, like `-s NAME=VALUE`
+    :return: the exit status, 0 like `scrapy crawl` on success
+    """
+
+    from scrapy.crawler import CrawlerProcess
+    # the project settings, which the spider and the pipelines read as well
+    from scrapy.conf import settings
+
+    try:
+        for key, value in (overrides or {}).items():
+            settings.set(key, value, priority='cmdline')
+        process = CrawlerProcess(settings)
+        process.crawl('TweetScraper', **spider_args)
+        process.start()
+    except Exception:
+        return 1
+    return 1 if getattr(process, 'bootstrap_failed', False) else 0
+
+
+class LocalScheduler(QueryScheduler):
+    """
+    Runs the queued scrapes without docker in a local pool of worker processes, at most workers at the same time.
+    Every scrape is forked into a fresh process which is dropped afterwards, so starting a scrape costs one fork
+    instead of a container. scrapy and the project are only imported in the workers: importing them installs the
+    twisted reactor, and workers forked after that would share its epoll instance and waker pipe. A scrape which
+    fails is queued again, up to retries times, and resumes from the checkpoints of the failed attempt
+    (-a resume=True).
+    """
+
+    def __init__(self, workers=None, retries=1, logger=None):
+        """
+        :param workers: how many scrapes may run at the same time (default: number of CPUs)
+        :param retries: how often a failed scrape is started again
+        :param logger: the logger
+        """
+        super(LocalScheduler, self).__init__(workers or multiprocessing.cpu_count(), retries, logger)
+        self.pool = None
+        self.jobs = list()
+
+    def overrides(self):
+        """
+        The settings of every scrape. With retries, the scrapes are checkpointed (the local folder is writable),
+        so that a retry can resume where the failed attempt stopped.
+
+        :return: dict with scrapy settings
+        """
+
+        overrides = dict()
+        if self.retries > 0:
+            overrides['CHECKPOINT_ENABLED'] = True
+        overrides.update(self.settings)
+        return overrides
+
+    def submit(self, name, spider_args):
+        """
+        Queues one scrape. It is started as soon as a worker is free.
+
+        :param name: the name of the scrape, used for the summary
+        :param spider_args: dict with the spider arguments, e.g. {"query": "foo"}
+        :return: None
+        """
+
+        if self.pool is None:
+            # one scrape per worker process, the reactor of a finished scrape can not be reused. The reactor must
+            # not be installed in this process (no scrapy imports here), every worker is forked from it
+            self.pool = multiprocessing.Pool(self.max_parallel, maxtasksperchild=1)
+            self.started = time.time()
+
+        self.logger.debug("Queued: " + str(name) + " " + str(spider_args))
+        self.jobs.append((name, spider_args, 1, time.time(), self.pool.apply_async(run_crawl, (spider_args, self.overrides()))))
+
+    def wait(self):
+        """
+        Blocks until all queued scrapes have finished and logs a summary.
+
+        :return: list with one result dict per scrape
+        """
+
+        if self.pool is None:
+            return list()
+
+        while self.jobs:
+            name, spider_args, attempt, start, job = self.jobs.pop(0)
+            try:
+                status = job.get()
+            except Exception as e:
+                self.logger.error("Scrape " + str(name) + " failed: " + str(e))
+                status = None
+
+            if status != 0 and attempt <= self.retries:
+                self.logger.warning("Scrape " + str(name) + " exited with " + str(status) + ", retrying ("
+                                    + str(attempt) + "/" + str(self.retries) + ")")
+                # continue from the checkpoints of the failed attempt instead of starting over
+                retry_args = dict(spider_args, resume=True)
+                self.jobs.append((name, spider_args, attempt + 1, start,
+                                  self.pool.apply_async(run_crawl, (retry_args, self.overrides()))))
+            else:
+                self.finished(name, spider_args, status, attempt, start)
+
+        self.pool.close()
+        self.pool.join()
+        self.pool = None
+
+        self.summary()
+        return self.results
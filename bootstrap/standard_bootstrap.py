@@ -1,7 +1,7 @@
 from exceptions.exceptions import TweetScrapeBootstrapException
 
-import time
-import docker
+import os
+from bootstrap.scheduler import ContainerScheduler, LocalScheduler
 
 
 class TweetScrapeBootstrap(object):
@@ -26,8 +26,37 @@ class TweetScrapeBootstrap(object):
         self.logger = logger
         self.args = args
 
+        # in batch mode the queries are collected and crawled by one container (see run_batch)
+        self.batch_queries = list() if args is not None and getattr(args, 'batch', False) else None
+        self.query_separator = ";"
+
         self.large_german_cities = list()
-        self.docker_client = docker.from_env()
+        self.docker_client = None
+
+        # the scrapes are started by the scheduler, in docker containers or in local worker processes
+        if getattr(args, 'backend', 'docker') == 'local':
+            self.scheduler = LocalScheduler(workers=getattr(args, 'workers', None),
+                                            retries=getattr(args, 'retries', 1),
+                                            logger=logger)
+        else:
+            # docker is only needed (and imported) for the docker backend
+            import docker
+            self.docker_client = docker.from_env()
+            self.scheduler = ContainerScheduler(self.docker_client,
+                                                max_containers=getattr(args, 'max_containers', 4),
+                                                retries=getattr(args, 'retries', 1),
+                                                volume=getattr(args, 'vol', None),
+                                                shared_volume=getattr(args, 'shared_dedup', None),
+                                                logger=logger)
+
+        # all scrapes skip the tweets another scrape has claimed first, in one database on the shared folder
+        if getattr(args, 'shared_dedup', None):
+            if self.docker_client is None:
+                shared_dedup_path = os.path.join(os.path.abspath(args.shared_dedup), "shared_dedup.db")
+            else:
+                shared_dedup_path = "/shared/shared_dedup.db"
+            self.scheduler.settings['SHARED_DEDUP_ENABLED'] = True
+            self.scheduler.settings['SHARED_DEDUP_PATH'] = shared_dedup_path
 
         self.read_large_german_cities()
 
@@ -53,41 +82,46 @@ class TweetScrapeBootstrap(object):
                 for line in file:
                     self.large_german_cities.append(line.replace("\n", " "))
 
-    def search(self):
+    def search(self, query_arg="query"):
         """
-        This method creates the final scrapy command which is needed to start scrapy and finally starts the docker
-        container where the scraper will run.
+        This method queues the search string for the scheduler, which starts the docker container where the scraper
+        will run as soon as there is a free slot (see wait). In batch mode the search string is only collected.
 
+        :param query_arg: the spider argument which takes the search string ("query" or "queries")
         :return: None
         """
 
-        temp_command = "scrapy crawl TweetScraper -a query=\"" + self.search_string + "\""
-        self.logger.debug("COMMAND: " + str(temp_command))
+        if self.batch_queries is not None and query_arg == "query":
+            self.logger.debug("Batched query: " + str(self.search_string))
+            self.batch_queries.append(self.search_string.strip())
+            return
 
-        if self.args.vol:
+        self.scheduler.submit(self.docker_image_name, {query_arg: self.search_string})
 
-            # the -v configuration for the docker
-            docker_volumes = {
-                self.args.vol: {
-                    'bind': '/home/tweetscraper/',
-                    'mode': 'ro'
-                }
-            }
+    def run_batch(self):
+        """
+        Starts one container which crawls all collected queries as concurrent chains of a single spider,
+        instead of one container per query.
 
-            self.docker_client.containers.run(image="tweetscraper_alpine:latest",
-                                              auto_remove=True,
-                                              detach=True,
-                                              name="tweetscraper_"+str(self.docker_image_name)+"_"+str(time.time()),
-                                              volumes=docker_volumes,
-                                              command=temp_command)
-        else:
-            temp_command = "scrapy crawl TweetScraper -a query=\"" + self.search_string + "\""
-            self.logger.debug("COMMAND: " + str(temp_command))
-            self.docker_client.containers.run(image="tweetscraper_alpine:latest",
-                                              auto_remove=True,
-                                              detach=True,
-                                              name="tweetscraper_" + str(self.docker_image_name) + "_" + str(time.time()),
-                                              command=temp_command)
+        :return: None
+        """
+
+        queries, self.batch_queries = self.batch_queries, None
+        if not queries:
+            return
+
+        self.logger.info("Crawling " + str(len(queries)) + " queries in one container")
+        self.search_string = self.query_separator.join(queries)
+        self.search(query_arg="queries")
+
+    def wait(self):
+        """
+        Blocks until all queued scrapes have finished and logs the wall time and exit status of each one.
+
+        :return: list with one result dict per scrape
+        """
+
+        return self.scheduler.wait()
 
     def search_near_large_german_cities(self, keyword_string):
         """
@@ -28,6 +28,19 @@ def parse_args(args):
     parser.add_argument('-vol', action="store", help="some Docker volume for your code binding")
     parser.add_argument('-lp', action="store", dest="custom_list",
                         help="Custom list path in case you want to make a bulk search for multiple keywords.")
+    parser.add_argument('--batch', action="store_true",
+                        help="Crawl all generated queries in a single container instead of one container per query.")
+    parser.add_argument('--max-containers', action="store", dest="max_containers", type=int, default=4,
+                        help="How many containers may run at the same time.")
+    parser.add_argument('--backend', action="store", dest="backend", choices=("docker", "local"), default="docker",
+                        help="Run the scrapes in docker containers or in a local pool of worker processes.")
+    parser.add_argument('-w', action="store", dest="workers", type=int, default=None,
+                        help="Number of local worker processes (backend local, default: number of CPUs).")
+    parser.add_argument('--shared-dedup', action="store", dest="shared_dedup", default=None,
+                        help="Host folder for a dedup database shared by all scrapes, so overlapping queries "
+                             "parse and save every tweet only once.")
+    parser.add_argument('--retries', action="store", dest="retries", type=int, default=1,
+                        help="How often a scrape is started again when its container exits with an error.")
 
     # params for querymode: dating_keywords
     parser.add_argument('--question', action="store_true")
@@ -135,6 +148,14 @@ def main():
     else:
         raise TweetScrapeBootstrapException("Yeah, no. Not like that. Try again my friend!")
 
+    # in batch mode nothing has been started yet
+    tsb.run_batch()
+
+    # wait for the queued containers and print the summary
+    failed = [result for result in tsb.wait() if result['status'] != 0]
+    if failed:
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()